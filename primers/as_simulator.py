@@ -0,0 +1,504 @@
+import re
+import ast
+import time
+import operator
+import threading
+import socketserver
+
+import numpy as np
+
+from kawasaki_robot import check_reach, forward_kinematics, poses_human_to_kawasaki, poses_kawasaki_to_human
+
+
+# 本地模拟川崎 AS 终端，只实现 Robot 用到的那部分指令，用于测试和测速
+# 没有任何认证，默认只监听 127.0.0.1
+#
+#   python as_simulator.py --port 2323 --latency 0.005
+#   robot.connect('127.0.0.1', port=2323)
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_TRANS = re.compile(r'TRANS\s*\(([^)]*)\)', re.I)
+_ASSIGN = re.compile(r'^([A-Za-z_][\w.]*)\s*=\s*(.+)$')
+_POINT = re.compile(r'^POINT\s+([A-Za-z_]\w*)\s*=\s*(.+)$', re.I)
+_LOGIC = re.compile(r'\b(AND|OR|NOT)\b', re.I)
+
+# 表达式只允许这些运算，不用 Python 的 eval（内容来自网络）
+_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Not: operator.not_,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+
+def _evaluate(node, names):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, names)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.Name):
+        key = node.id.lower()
+        if key not in names:
+            raise NameError(f'未定义的变量: {node.id}')
+        return names[key]
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.operand, names))
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.left, names), _evaluate(node.right, names))
+    if isinstance(node, ast.BoolOp):
+        values = [_evaluate(v, names) for v in node.values]
+        return all(values) if isinstance(node.op, ast.And) else any(values)
+    if isinstance(node, ast.Compare) and all(type(op) in _OPERATORS for op in node.ops):
+        left = _evaluate(node.left, names)
+        for op, right in zip(node.ops, node.comparators):
+            right = _evaluate(right, names)
+            if not _OPERATORS[type(op)](left, right):
+                return False
+            left = right
+        return True
+    raise ValueError(f'不支持的表达式: {ast.dump(node)}')
+
+
+def _trans(text, points):
+    # TRANS(x, y, z, o, a, t) 或点位变量名 -> 6 元素数组
+    m = _TRANS.search(text)
+    if m:
+        values = [float(x) for x in m.group(1).split(',') if x.strip()]
+        values += [0.0] * (6 - len(values))
+        return np.array(values[:6])
+    name = text.strip().lower()
+    if name in points:
+        return points[name].copy()
+    raise ValueError(f'未定义的点位: {text}')
+
+
+class SimRobot:
+    '''
+    控制器状态：位姿（川崎坐标系）、变量、点位、程序和当前运动。
+    运动按直线插补，时间由距离和速度决定，WHERE 返回插补中的位姿。
+    关节角由 kawasaki_robot 的近似运动学（check_reach、forward_kinematics）从位姿算出，
+    与真实控制器的数值不同；到不了的位姿保持上一次的关节角。
+    '''
+
+    def __init__(self, pose=(0, 1000, 0, -90, 180, 90), max_speed=1000, max_rotation=180,
+                 motion_time=None):
+        self.lock = threading.RLock()
+        self.pose = np.array(pose, dtype=float)
+        self.joints = np.zeros(6)           # 最近一次算出的关节角
+        self.max_speed = max_speed          # 100% 速度时的线速度 mm/s
+        self.max_rotation = max_rotation    # 100% 速度时的角速度 deg/s
+        self.motion_time = motion_time      # 固定每段运动的时间，None 按速度计算
+        self.speed = 100.0
+        self.accuracy = 100.0
+        self.variables = {'progress': 0.0}
+        self.points = {}
+        self.programs = {}
+        self.motion = None                  # (起点, 终点, 开始时间, 时长)
+        self.task = None                    # 正在运行的程序
+        self.completed = 0
+
+    # 运动
+    def current_pose(self, now=None):
+        with self.lock:
+            if self.motion is None:
+                return self.pose.copy()
+            start, end, t0, duration = self.motion
+            now = time.monotonic() if now is None else now
+            k = 1.0 if duration <= 0 else min(1.0, (now - t0) / duration)
+            pose = start + (end - start) * k
+            if k >= 1.0:
+                self.pose, self.motion = end, None
+            return pose
+
+    def moving(self):
+        with self.lock:
+            self.current_pose()
+            return self.motion is not None
+
+    def current_joints(self, pose=None):
+        # 位姿的逆解，pose 默认为当前位姿
+        with self.lock:
+            pose = self.current_pose() if pose is None else pose
+            reach = check_reach(poses_kawasaki_to_human(pose))
+            if reach.reachable[0]:
+                self.joints = reach.joints[0]
+            return self.joints.copy()
+
+    def drive(self, joint, degrees):
+        # DRIVE：按当前的关节角转动一个关节，末端沿正解的位姿直线插补过去
+        with self.lock:
+            joints = self.current_joints()
+            joints[joint - 1] += degrees
+            return self.move_to(poses_human_to_kawasaki(forward_kinematics(joints))[0])
+
+    def move_to(self, target):
+        # 开始一段运动，返回预计的时长
+        with self.lock:
+            start = self.current_pose()
+            if self.motion_time is not None:
+                duration = self.motion_time
+            else:
+                speed = max(self.speed, 0.1) / 100
+                d = np.linalg.norm(target[:3] - start[:3]) / (self.max_speed * speed)
+                a = np.abs((target[3:] - start[3:] + 180) % 360 - 180).max()
+                duration = max(d, a / (self.max_rotation * speed))
+            self.motion = (start, np.asarray(target, dtype=float), time.monotonic(), duration)
+            return duration
+
+    def hold(self):
+        with self.lock:
+            self.pose = self.current_pose()
+            self.motion = None
+            if self.task is not None:
+                self.task.stop = True
+
+    def wait_motion(self, task):
+        while not task.stop:
+            with self.lock:
+                if self.motion is None:
+                    return
+                remaining = self.motion[2] + self.motion[3] - time.monotonic()
+            if remaining <= 0:
+                self.current_pose()
+                continue
+            time.sleep(min(remaining, 0.01))
+
+    # 表达式，只支持程序里用到的简单写法
+    def eval(self, expr):
+        expr = expr.strip().replace('<>', '!=')
+        names = {'true': -1, 'false': 0}
+        names.update(self.variables)
+        expr = re.sub(r'(?<![<>!=])=(?!=)', '==', expr)
+        expr = _LOGIC.sub(lambda m: m.group(1).lower(), expr)
+        value = _evaluate(ast.parse(expr, mode='eval'), names)
+        return -1 if value is True else (0 if value is False else value)
+
+
+class Task(threading.Thread):
+    # 在后台执行一段 AS 程序
+
+    def __init__(self, robot, name, lines, on_end):
+        super().__init__(daemon=True)
+        self.robot = robot
+        self.name = name
+        self.lines = lines
+        self.on_end = on_end
+        self.stop = False
+        self.step = 1
+        self.statement = ''
+        self.error = None
+        self.match = self._match_blocks(lines)
+
+    @staticmethod
+    def _match_blocks(lines):
+        match, stack = {}, []
+        for i, line in enumerate(lines):
+            word = line.split(None, 1)[0].upper() if line.strip() else ''
+            if word in ('WHILE', 'IF'):
+                stack.append(i)
+            elif word == 'ELSE' and stack:
+                # IF 不成立时跳到 ELSE 之后，执行到 ELSE 时跳到 END 之后
+                match[stack[-1]] = i
+            elif word == 'END' and stack:
+                j = stack.pop()
+                if j in match:
+                    match[match[j]] = i
+                    match[i] = j
+                else:
+                    match[i], match[j] = j, i
+        return match
+
+    def run(self):
+        robot = self.robot
+        lines, pc = self.lines, 0
+        try:
+            while pc < len(lines) and not self.stop:
+                line = lines[pc].strip()
+                self.step, self.statement = pc + 1, line
+                word = line.split(None, 1)[0].upper() if line else ''
+                rest = line[len(word):].strip()
+                if word == 'WHILE':
+                    cond = re.sub(r'\s+DO$', '', rest, flags=re.I)
+                    pc = pc + 1 if robot.eval(cond) else self.match[pc] + 1
+                    continue
+                if word == 'IF':
+                    cond = re.sub(r'\s+THEN$', '', rest, flags=re.I)
+                    pc = pc + 1 if robot.eval(cond) else self.match[pc] + 1
+                    continue
+                if word == 'ELSE':
+                    pc = self.match[pc] + 1
+                    continue
+                if word == 'END':
+                    opener = self.match.get(pc)
+                    if opener is not None and lines[opener].split()[0].upper() == 'WHILE':
+                        pc = opener
+                    else:
+                        pc += 1
+                    continue
+                self.execute(word, rest, line)
+                pc += 1
+            robot.wait_motion(self)
+        except Exception as e:
+            self.error = f'{self.name} 第 {self.step} 步: {e}'
+            self.stop = True
+        finally:
+            with robot.lock:
+                if robot.task is self:
+                    robot.task = None
+                    if not self.stop:
+                        robot.completed += 1
+            self.on_end(self)
+
+    def execute(self, word, rest, line):
+        robot = self.robot
+        if word in ('JMOVE', 'LMOVE', 'C1MOVE', 'C2MOVE'):
+            robot.wait_motion(self)
+            robot.move_to(_trans(rest, robot.points))
+        elif word == 'BREAK':
+            robot.wait_motion(self)
+        elif word in ('DRAW', 'TDRAW'):
+            robot.wait_motion(self)
+            delta = [float(x) for x in rest.split(',')] + [0.0] * 6
+            robot.move_to(robot.current_pose() + np.array(delta[:6]))
+        elif word == 'TWAIT':
+            time.sleep(float(rest))
+        elif word == 'SPEED':
+            robot.speed = float(re.match(_NUMBER, rest).group())
+        elif word == 'POINT':
+            m = _POINT.match(line)
+            robot.points[m.group(1).lower()] = _trans(m.group(2), robot.points)
+        elif _ASSIGN.match(line) and word not in ('ACCURACY', 'PRINT'):
+            name, expr = _ASSIGN.match(line).groups()
+            robot.variables[name.lower()] = robot.eval(expr)
+        # ACCURACY、TOOL、UWRIST、PRINT、REP_ONCE 等不影响模拟的位姿
+
+
+class Terminal(socketserver.BaseRequestHandler):
+    '''
+    一个 telnet 连接。回复的格式：回显指令 + 输出 + \\r\\n>，
+    编辑模式下每行只回显行号提示，不出现 >。
+    '''
+
+    def setup(self):
+        self.sim = self.server.sim
+        self.write_lock = threading.Lock()
+        self.editing = None         # 正在编辑的程序名
+        self.expect_blank = False   # POINT、SWITCH 之后多出的一个回车
+
+    def send(self, text):
+        data = text.encode('GBK') if isinstance(text, str) else text
+        options = self.server.options
+        size, delay = options['chunk_size'], options['chunk_delay']
+        with self.write_lock:
+            if not size:
+                self.request.sendall(data)
+                return
+            for i in range(0, len(data), size):
+                if i and delay:
+                    time.sleep(delay)
+                self.request.sendall(data[i:i + size])
+
+    def handle(self):
+        self.send('login: ')
+        buf = b''
+        while True:
+            try:
+                data = self.request.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            while b'\n' in buf:
+                line, buf = buf.split(b'\n', 1)
+                self.on_line(line.decode('GBK').strip('\r'))
+
+    def on_line(self, line):
+        if self.editing is not None:
+            return self.edit(line)
+        if not line.strip():
+            if self.expect_blank:
+                self.expect_blank = False
+                return
+            return self.send('\r\n>')
+        word = line.split(None, 1)[0].upper()
+        latency = self.server.options['latency']
+        delay = latency.get(word, latency.get('*', 0)) if isinstance(latency, dict) else latency
+        if delay:
+            time.sleep(delay)
+        try:
+            body = self.monitor(word, line.split(None, 1)[1].strip() if ' ' in line.strip() else '', line)
+        except Exception as e:
+            body = f'(P1000) 指令错误: {e}'
+        if self.editing is not None:
+            # 进入编辑模式后只有行号提示，没有 >
+            return self.send(line + '\r\n' + body)
+        self.send(line + '\r\n' + (body + '\r\n' if body else '') + '>')
+
+    def edit(self, line):
+        program = self.sim.programs[self.editing]
+        word = line.strip().split(None, 1)[0].upper() if line.strip() else ''
+        if word == 'E':
+            self.editing = None
+            return self.send(line + '\r\n>')
+        if word == 'D':
+            program.clear()
+        elif line.strip():
+            program.append(line.strip())
+        self.send(f'{line}\r\n{len(program) + 1} ?')
+
+    def monitor(self, word, rest, line):
+        sim = self.sim
+        if word == 'AS':
+            return ''
+        if word == 'EDIT':
+            name = rest.split(',')[0].strip().lower()
+            self.editing = name
+            sim.programs.setdefault(name, [])
+            return f'.PROGRAM {name}()\r\n{len(sim.programs[name]) + 1} ?'
+        if word == 'EXECUTE':
+            return self.execute(rest.split(',')[0].strip().lower())
+        if word == 'STATUS':
+            return self.status()
+        if word in ('WHERE', 'WH'):
+            if rest:
+                self.expect_blank = True
+            return self.where()
+        if word == 'PRINT':
+            value = sim.eval(rest) if not rest.startswith('"') else rest.strip('"')
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            return str(value)
+        if word in ('HOLD', 'ABORT'):
+            sim.hold()
+            return ''
+        if word == 'DO':
+            return self.do(rest)
+        if word == 'SPEED':
+            sim.speed = float(re.match(_NUMBER, rest).group())
+            return ''
+        if word == 'POINT':
+            m = _POINT.match(line)
+            sim.points[m.group(1).lower()] = pose = _trans(m.group(2), sim.points)
+            self.expect_blank = True
+            return ' '.join(f'{x:.3f}' for x in pose)
+        if word == 'SWITCH':
+            self.expect_blank = True
+            return ' CHECK.HOLD         OFF    CP                 ON\r\n'\
+                   ' CYCLE.STOP         OFF    OX.PREOUT          ON'
+        if word == 'IO':
+            return '  32-   1 xxxxxxxx xxxxxxxx xxxxxxxx xxxxxxxx'
+        if _ASSIGN.match(line):
+            name, expr = _ASSIGN.match(line).groups()
+            sim.variables[name.lower()] = sim.eval(expr)
+            return ''
+        # REP_ONCE、ERESET、TOOL 等：只给提示符
+        return ''
+
+    def do(self, rest):
+        sim = self.sim
+        word = rest.split(None, 1)[0].upper()
+        arg = rest[len(word):].strip()
+        if word in ('JMOVE', 'LMOVE'):
+            sim.move_to(_trans(arg, sim.points))
+        elif word == 'DRIVE':
+            joint, degrees = (float(x) for x in arg.split(',')[:2])
+            sim.drive(int(joint), degrees)
+        return ''
+
+    def execute(self, name):
+        sim = self.sim
+        with sim.lock:
+            if sim.task is not None:
+                return '(P1003) 程序已在运行'
+            if name not in sim.programs:
+                return f'(P1002) 程序不存在: {name}'
+
+            def on_end(task):
+                if not task.stop:
+                    try:
+                        self.send('\r\n程序结束\r\n')
+                    except OSError:
+                        pass
+
+            sim.task = Task(sim, name, list(sim.programs[name]), on_end)
+            sim.task.start()
+        return ''
+
+    def status(self):
+        sim = self.sim
+        task = sim.task
+        # DO JMOVE 等单独的运动没有程序，也算运行中
+        running = '程序运行中' if task is not None or sim.moving() else '程序未运行'
+        lines = [
+            '机器人状态',
+            '再现模式',
+            '',
+            '环境设定状况:',
+            f' 监控速度(%)= {sim.speed:10.1f}',
+            f' ALWAYS程序速度(%)= {100.0:10.1f} {100.0:10.1f}',
+            f' ALWAYS 精度[mm] = {sim.accuracy:10.1f}',
+            '',
+            f'Stepper状态   {running}',
+            '程序运行次数',
+            f'  已运行完成次数: {sim.completed:7d}',
+            f'  剩余运行次数: {0:9d}',
+            '程序名              优先级 步骤号',
+        ]
+        if task is not None:
+            lines.append(f' {task.name:<26} 0 {task.step:4d}         {task.statement}')
+        return '\r\n'.join(lines)
+
+    def where(self):
+        sim = self.sim
+        pose = sim.current_pose()
+        fmt = lambda v: ''.join(f'{x:10.3f}' for x in v)
+        return '\r\n'.join([
+            '     JT1       JT2       JT3       JT4       JT5       JT6',
+            fmt(sim.current_joints(pose)),
+            '     X[mm]     Y[mm]     Z[mm]     O[deg]    A[deg]    T[deg]',
+            fmt(pose),
+        ])
+
+
+class Simulator(socketserver.ThreadingTCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, chunk_size=0, chunk_delay=0.0,
+                 **robot_options):
+        '''
+        latency      每条监控指令的处理时间（秒），也可按指令给 dict，'*' 为默认值
+        chunk_size   回复分块发送的大小，0 为整段发送
+        chunk_delay  分块之间的间隔（秒）
+        其余参数传给 SimRobot（max_speed、max_rotation、motion_time 等）
+        '''
+        super().__init__(address, Terminal)
+        self.sim = SimRobot(**robot_options)
+        self.options = {'latency': latency, 'chunk_size': chunk_size, 'chunk_delay': chunk_delay}
+
+    def start(self):
+        # 在后台线程中运行，返回 (host, port)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='川崎 AS 终端模拟器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=23)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int, default=0)
+    parser.add_argument('--chunk-delay', type=float, default=0.0)
+    parser.add_argument('--motion-time', type=float, default=None)
+    args = parser.parse_args()
+    server = Simulator((args.host, args.port), args.latency, args.chunk_size, args.chunk_delay,
+                       motion_time=args.motion_time)
+    print('listen:', server.server_address)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
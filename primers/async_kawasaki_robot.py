@@ -0,0 +1,364 @@
+import asyncio
+from collections import deque
+
+from kawasaki_robot import Robot, MotionWaiter, Pose, draw_pose, tdraw_pose, pose_kawasaki_to_human, format_numbers
+from kawasaki_robot import parse_where, parse_status, parse_io, parse_switch, is_running, PROMPT
+
+
+def _gbk(r):
+    return r.decode('GBK')
+
+
+def _then(fut, func):
+    # 在回复到达后再做解析，指令本身已经写出
+    async def then():
+        return func(await fut)
+    return asyncio.ensure_future(then())
+
+
+class AsyncMotionWaiter(MotionWaiter):
+    '''
+    MotionWaiter 的 asyncio 版本：共用一个轮询任务，等待者拿到 asyncio.Future。
+    终端出现程序结束的提示时不等下一次轮询，立即确认一次。
+    '''
+
+    def future(self, callback=None):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        if callback is not None:
+            fut.add_done_callback(callback)
+        self._waiters.append(fut)
+        if self._thread is None:
+            self._thread = loop.create_task(self._run())
+        return fut
+
+    async def _run(self):
+        end = self.robot.wait_for('程序结束')
+        interval, backoff = self.next_interval(self.min_interval)
+        try:
+            while self._waiters:
+                moving = None
+                try:
+                    await asyncio.wait_for(asyncio.shield(end), interval)
+                except asyncio.TimeoutError:
+                    pass
+                except Exception as e:
+                    # 连接断开时 _read_loop 把异常交给 end，与轮询失败一样处理
+                    moving = e
+                waiters = list(self._waiters)
+                if moving is None:
+                    try:
+                        moving = await self.robot.is_moving
+                    except Exception as e:
+                        moving = e
+                    self.polls += 1
+                if moving is not True:
+                    for fut in waiters:
+                        self._waiters.remove(fut)
+                        if fut.done():
+                            continue
+                        if isinstance(moving, Exception):
+                            fut.set_exception(moving)
+                        else:
+                            fut.set_result(True)
+                if end.done():
+                    end = self.robot.wait_for('程序结束')
+                interval, backoff = self.next_interval(backoff)
+        finally:
+            end.cancel()
+            self._thread = None
+            # 意外退出（如任务被取消）时不让等待者一直等下去
+            for fut in self._waiters:
+                if not fut.done():
+                    fut.set_exception(ConnectionError('等待运动结束的任务已退出'))
+            self._waiters.clear()
+
+
+class AsyncRobot(Robot):
+    '''
+    基于 asyncio 的 AS 终端客户端，接口与 Robot 相同。
+
+    execute 写出指令后立即返回一个 Future，可以连续发出多条指令而不必
+    等待每个 > 提示符，回复按发送顺序（FIFO）逐条对应到各自的 Future：
+
+        a = robot.execute('PRINT progress')
+        b = robot.execute('STATUS')
+        progress, status = await a, await b
+    '''
+
+    def __init__(self, timeout=0.5, recv_timeout=10, tracker=None, tracer=None):
+        super().__init__(timeout, recv_timeout, tracker, tracer=tracer)
+        self._pending = deque()     # (feedback, future)，等待回复的指令
+        self._watchers = []         # (pattern, future)，等待某段输出出现
+        self._tail = b''
+        self._reader_task = None
+        self.waiter = AsyncMotionWaiter(self)
+
+    async def connect(self, host='192.168.0.2', port=23):
+        # asyncio 的 TCP 连接默认已设置 TCP_NODELAY
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        self.sock = self._writer.get_extra_info('socket')
+        self._reader_task = asyncio.create_task(self._read_loop())
+        return await self.execute(b'as\n')
+
+    async def disconnect(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def _read_loop(self):
+        buf = bytearray()
+        try:
+            while True:
+                data = await self._reader.read(4096)
+                if not data:
+                    raise ConnectionError('连接已断开')
+                if self.tracer is not None:
+                    self.tracer.record('recv', data)
+                self._watch(data)
+                buf += data
+                while self._pending:
+                    feedback, fut = self._pending[0]
+                    i = buf.find(feedback)
+                    if i == -1:
+                        break
+                    i += len(feedback)
+                    reply = bytes(buf[:i])
+                    del buf[:i]
+                    self._pending.popleft()
+                    if not fut.done():
+                        fut.set_result(reply)
+                if not self._pending:
+                    # 没有指令在等待时到达的输出（如程序结束的提示）只交给 _watch
+                    buf.clear()
+        except Exception as e:
+            self._lose_pose()
+            if self.tracer is not None:
+                self.tracer.error(e)
+            for _, fut in list(self._pending) + self._watchers:
+                if not fut.done():
+                    fut.set_exception(e)
+            self._pending.clear()
+            self._watchers.clear()
+            if not isinstance(e, ConnectionError):
+                raise
+
+    def _watch(self, data):
+        if not self._watchers:
+            self._tail = b''
+            return
+        window = self._tail + data
+        for item in list(self._watchers):
+            pattern, fut = item
+            if pattern in window or fut.done():
+                self._watchers.remove(item)
+                if not fut.done():
+                    fut.set_result(window)
+        keep = max((len(p) for p, _ in self._watchers), default=1) - 1
+        self._tail = window[-keep:] if keep else b''
+
+    def wait_for(self, pattern):
+        # 返回一个 Future，当终端输出中出现 pattern 时完成
+        if isinstance(pattern, str):
+            pattern = pattern.encode('GBK')
+        fut = asyncio.get_running_loop().create_future()
+        self._watchers.append((pattern, fut))
+        return fut
+
+    def recv(self, feedback=PROMPT, timeout=-1, count=1):
+        # 不发送任何内容，只排队等待接下来 count 段以 feedback 结尾的回复
+        if timeout == -1:
+            timeout = self.recv_timeout
+        if isinstance(feedback, str):
+            feedback = feedback.encode()
+        loop = asyncio.get_running_loop()
+        for _ in range(count):
+            fut = loop.create_future()
+            self._pending.append((feedback, fut))
+        if timeout is None:
+            return fut
+        return asyncio.ensure_future(asyncio.wait_for(fut, timeout))
+
+    def _write(self, data):
+        if self.tracer is not None:
+            self.tracer.record('send', data)
+        self._writer.write(data)
+
+    def execute(self, cmd, debug=True, feedback=PROMPT):
+        if isinstance(cmd, str):
+            cmd = cmd.encode()
+        if not cmd.endswith(b'\n'):
+            cmd = cmd + b'\n'
+        self._write(cmd)
+        return self.recv(feedback=feedback)
+
+    # 以下查询都在调用时立即写出指令，返回的 Future 可以稍后再 await
+    # 5.6 系统控制指令
+    def get_status(self):
+        return _then(self.execute(b'STATUS\n'), _gbk)
+
+    def get_where(self, mode=''):
+        if mode:
+            r = self.execute(f'WHERE {mode}\n', feedback='\n')
+            self._write(b'\n')
+        else:
+            r = self.execute(b'WHERE\n')
+        return _then(r, _gbk)
+
+    def read_status(self):
+        return _then(self.execute(b'STATUS\n'), parse_status)
+
+    def read_where(self):
+        return _then(self.execute(b'WHERE\n'), parse_where)
+
+    def read_io(self):
+        return _then(self.execute(b'IO\n'), parse_io)
+
+    def read_switch(self):
+        return _then(self.execute(b'SWITCH\n\n'), parse_switch)
+
+    def get_io(self):
+        return _then(self.execute(b'IO\n'), _gbk)
+
+    def get_switch(self):
+        return _then(self.execute(b'SWITCH\n\n'), _gbk)
+
+    def set_rep_once(self, p=False):
+        p = 'ON' if p else 'OFF'
+        return _then(self.execute(f'REP_ONCE {p}\n'), _gbk)
+
+    @property
+    def is_moving(self):
+        return _then(self.execute(b'STATUS\n'), is_running)
+
+    async def wait(self, timeout=None):
+        return await asyncio.wait_for(self.motion_done(), timeout)
+
+    def get_joint_and_pose(self):
+        return _then(self.execute(b'wh\n'), parse_where)
+
+    @property
+    def world_n(self):
+        return self._get_world_n()
+
+    async def _get_world_n(self):
+        if self.tracker is not None:
+            pose = self.tracker.pose
+            if pose is not None:
+                return pose
+        pose = (await self.get_joint_and_pose())[1]
+        pose = pose_kawasaki_to_human(pose)
+        if self.tracker is not None:
+            self.tracker.sync(pose)
+        return pose
+
+    async def resync(self):
+        # 丢弃本地位姿，重新从控制器读取
+        self._lose_pose()
+        return await self.world_n
+
+    @property
+    def axis_n(self):
+        return self._get_axis_n()
+
+    async def _get_axis_n(self):
+        return (await self.get_joint_and_pose())[0]
+
+    async def _execute_project(self, waiting=False):
+        end_pose = self._program.end_pose
+        duration = self.motion_time(self._program.path, self._start_pose())
+        await self.execute(self._end_edit())    # 一次写出整段程序并退出编辑
+        r = await self.execute(f'EXECUTE {self._cur_project_name}\n')
+        self.waiter.expect(duration)
+        self._track_reply(r, end_pose)
+        if waiting:
+            await self.wait()
+        return r
+
+    async def pose_move(self, pose, cmd):
+        # 收到回复后再更新本地位姿，控制器报错时不会记下没有到达的目标
+        pose = Pose.of(pose)
+        human = list(pose.human())
+        start = self._start_pose()
+        r = await self.execute(f'DO {cmd} TRANS({format_numbers(pose.kawasaki())})\n')
+        self.waiter.expect(self.motion_time([human], start))
+        self._track_reply(r, human)
+        return r
+
+    def set_progress(self, value):
+        return self.execute(f'progress = {value}\n')
+
+    def get_progress(self):
+        return _then(self.execute('PRINT progress'), lambda r: int(r.split(b'\n')[-2]))
+
+    async def tool(self, x=0, y=0, z=0):
+        x, y, z = -y, x, z
+        await self.execute(f'POINT p = TRANS({x}, {y}, {z})\n\n')
+        await self.execute(b'DO TOOL p\n')
+        self._lose_pose()
+
+    def ereset(self):
+        self._lose_pose()
+        return self.execute(b'ereset\n')
+
+    async def start_teleop(self, pose=None):
+        if pose is None:
+            pose = await self.world_n
+        self._teleop_seq = 0
+        self._edit_project('teleop')
+        for statement in self.TELEOP_PROGRAM:
+            self._send(statement)
+        await self.execute(self._end_edit())
+        self._write(self._teleop_target(pose).encode())
+        await self.recv(count=2)
+        r = await self.execute(b'EXECUTE teleop\n')
+        self._track(pose)
+        return r
+
+    def teleop_move(self, pose):
+        # 返回的 Future 在控制器确认后给出本次目标的序号，确认之后才记录本地位姿
+        self._write(self._teleop_target(pose).encode())
+        seq = self._teleop_seq
+        replies = [self.recv(), self.recv()]
+
+        async def accepted():
+            try:
+                r = b''.join([await fut for fut in replies])
+            except Exception:
+                self._lose_pose()
+                raise
+            self._track_reply(r, pose)
+            return seq
+        return asyncio.ensure_future(accepted())
+
+    async def draw(self, x=0, y=0, z=0, u=0, v=0, w=0):
+        # 相对世界坐标系移动
+        pose = draw_pose(await self.world_n, x, y, z, u, v, w)
+        return await self.freemove(pose)
+
+    async def tdraw(self, x=0, y=0, z=0, u=0, v=0, w=0):
+        # 相对相机坐标系移动
+        pose = tdraw_pose(await self.world_n, x, y, z, u, v, w)
+        return await self.freemove(pose)
+
+
+async def tests():
+    robot = AsyncRobot()
+    await robot.connect()
+
+    # 三条指令一起发出，按顺序取回各自的回复
+    status = robot.get_status()
+    joint_and_pose = robot.get_joint_and_pose()
+    progress = robot.get_progress()
+    print(await status)
+    print(await joint_and_pose)
+    print(await progress)
+
+    await robot.draw(y=100)
+    await robot.wait()
+    await robot.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(tests())
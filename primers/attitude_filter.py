@@ -0,0 +1,296 @@
+import sys
+import math
+import bisect
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+import phone_protocol
+from recording import Recording
+
+
+# 手机姿态的滤波：每来一个样本调用 update(姿态, immediately, 时间)，
+# 需要下发新目标时返回滤波后的姿态（Rotation），否则返回 None。
+# immediately（按钮）总是立即下发当前姿态。
+
+
+def _angle(a, b):
+    return (a.inv() * b).magnitude()
+
+
+def _slerp(a, b, t):
+    return a * R.from_rotvec((a.inv() * b).as_rotvec() * t)
+
+
+class DeadBand:
+    '''
+    原来 Gate 的做法：转动超过 threshold 后等姿态稳定 settle 秒再下发。
+    '''
+
+    def __init__(self, threshold=20, settle=0.9):
+        self.threshold = math.radians(threshold)
+        self.settle = settle
+        self.reset()
+
+    def reset(self):
+        self.ref = None
+        self.moving = False
+        self.settle_at = 0
+
+    def update(self, attitude, immediately=False, now=0.0):
+        if self.ref is None:
+            self.ref = attitude
+            return None
+        if not immediately and _angle(self.ref, attitude) > self.threshold:
+            self.moving = True
+            self.settle_at = now + self.settle
+            self.ref = attitude
+        elif immediately or (self.moving and now >= self.settle_at):
+            self.moving = False
+            self.ref = attitude
+            return attitude
+        return None
+
+
+class OneEuro:
+    '''
+    四元数上的 one-euro 滤波：按角速度调整截止频率的 SLERP 低通，
+    手抖（慢）时截止频率低、滤得狠，有意的转动（快）时截止频率高、跟得紧。
+    滤波后的姿态与上次下发的相差超过 min_change 度才下发。
+
+    min_cutoff  静止时的截止频率 Hz，越小越稳
+    beta        截止频率随角速度（rad/s）增加的比例，越大跟得越紧
+    d_cutoff    角速度本身的低通截止频率 Hz
+    '''
+
+    def __init__(self, min_cutoff=0.5, beta=4.0, d_cutoff=1.0, min_change=2):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.min_change = math.radians(min_change)
+        self.reset()
+
+    def reset(self):
+        self.value = None       # 滤波后的姿态
+        self.rate = 0.0         # 滤波后的角速度 rad/s
+        self.sent = None        # 上次下发的姿态
+        self.t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1 / (2 * math.pi * cutoff)
+        return 1 / (1 + tau / dt)
+
+    def update(self, attitude, immediately=False, now=0.0):
+        if self.value is None or immediately:
+            # 第一个样本只作为基准，按钮立即下发
+            self.value = self.sent = attitude
+            self.t = now
+            return attitude if immediately else None
+        dt = now - self.t
+        if dt <= 0:
+            return None
+        self.t = now
+        rate = _angle(self.value, attitude) / dt
+        self.rate += self._alpha(self.d_cutoff, dt) * (rate - self.rate)
+        cutoff = self.min_cutoff + self.beta * self.rate
+        self.value = _slerp(self.value, attitude, self._alpha(cutoff, dt))
+        if _angle(self.sent, self.value) > self.min_change:
+            self.sent = self.value
+            return self.value
+        return None
+
+
+class Predictor:
+    '''
+    由相邻样本估计角速度（低通后），把姿态外推到 lookahead 秒之后，
+    补偿上传、EXECUTE 和 JMOVE 的延迟。lookahead 限制在 max_lookahead 之内，
+    外推的角度不超过 max_angle 度，样本间隔超过 max_gap 秒时不外推。
+    '''
+
+    def __init__(self, lookahead=0.2, max_lookahead=0.5, max_angle=30, cutoff=5.0, max_gap=0.2):
+        self.max_lookahead = max_lookahead
+        self.lookahead = lookahead
+        self.max_angle = math.radians(max_angle)
+        self.cutoff = cutoff
+        self.max_gap = max_gap
+        self.reset()
+
+    @property
+    def lookahead(self):
+        return self._lookahead
+
+    @lookahead.setter
+    def lookahead(self, value):
+        self._lookahead = min(max(value, 0.0), self.max_lookahead)
+
+    def reset(self):
+        self.last = None
+        self.t = None
+        self.omega = np.zeros(3)    # 世界坐标系下的角速度 rad/s
+
+    def update(self, attitude, now):
+        if self.last is not None:
+            dt = now - self.t
+            if dt > self.max_gap:
+                self.omega[:] = 0
+            elif dt > 0:
+                omega = (attitude * self.last.inv()).as_rotvec() / dt
+                self.omega += OneEuro._alpha(self.cutoff, dt) * (omega - self.omega)
+        self.last = attitude
+        self.t = now
+
+    def predict(self, attitude):
+        rotvec = self.omega * self.lookahead
+        angle = np.linalg.norm(rotvec)
+        if angle > self.max_angle:
+            rotvec *= self.max_angle / angle
+        return R.from_rotvec(rotvec) * attitude
+
+
+class Predictive:
+    '''
+    每个样本都交给 predictor 估计角速度，滤波器决定下发时下发外推后的姿态。
+    转动停下后外推量随角速度回落，与上次下发的相差超过 min_change 度时再下发一次，
+    不会停在外推过头的位置。
+    '''
+
+    def __init__(self, attitude_filter, predictor, min_change=2):
+        self.filter = attitude_filter
+        self.predictor = predictor
+        self.min_change = math.radians(min_change)
+        self.sent = None
+
+    def reset(self):
+        self.filter.reset()
+        self.predictor.reset()
+        self.sent = None
+
+    def update(self, attitude, immediately=False, now=0.0):
+        out = self.filter.update(attitude, immediately, now)
+        # 有滤波值（OneEuro）时用滤波值估计角速度，手抖不会被外推放大
+        current = getattr(self.filter, 'value', None)
+        self.predictor.update(attitude if current is None else current, now)
+        if immediately:
+            self.sent = out
+            return out
+        # 滤波器没有下发时用当前的滤波值（DeadBand 没有，只在下发时外推）
+        current = out if out is not None else current
+        if current is None:
+            return None
+        predicted = self.predictor.predict(current)
+        if out is not None or (self.sent is not None and _angle(self.sent, predicted) > self.min_change):
+            self.sent = predicted
+            return predicted
+        return None
+
+
+FILTERS = {
+    'deadband': DeadBand,
+    'one_euro': OneEuro,
+}
+
+# server 默认使用的滤波器及其参数，原来的做法为 deadband
+# predict 把下发的姿态外推 lookahead 秒，补偿上传和运动的延迟，None 则不外推
+DEFAULT = {'name': 'one_euro', 'predict': {'lookahead': 0.2, 'max_lookahead': 0.5}}
+
+
+def make_filter(name='one_euro', predict=None, **options):
+    # 按名字和参数创建滤波器，便于在配置里按现场调整；predict 为 Predictor 的参数
+    attitude_filter = FILTERS[name](**options)
+    if predict is not None:
+        attitude_filter = Predictive(attitude_filter, Predictor(**predict))
+    return attitude_filter
+
+
+def read_samples(path, client=None):
+    # 读取 recording.Recorder 录制的文件里一部手机的姿态，默认为第一部；
+    # client 为 Recording.events 给出的 (会话序号, 手机编号)
+    samples = []
+    with Recording(path) as recording:
+        for event in recording.events(('phone',)):
+            cid, sample = event.data
+            if client is None:
+                client = cid
+            if cid == client:
+                samples.append(sample)
+    return samples
+
+
+def synthetic(duration=10, rate=100, jitter=0.3, seed=0):
+    # 手抖加几次有意转动的模拟姿态流，单位与手机相同（弧度）
+    rng = np.random.default_rng(seed)
+    t = np.arange(0, duration, 1 / rate)
+    yaw = np.zeros_like(t)
+    for start in range(1, int(duration), 3):
+        # 每 3 秒一次 0.5 秒内转 30 度
+        yaw += np.radians(30) * np.clip((t - start) / 0.5, 0, 1)
+    attitude = np.stack((np.zeros_like(t), np.zeros_like(t), yaw), axis=1)
+    attitude += np.radians(jitter) * rng.standard_normal(attitude.shape)
+    return [phone_protocol.Sample(i, ti, tuple(a), False) for i, (ti, a) in enumerate(zip(t, attitude))]
+
+
+def evaluate(attitude_filter, samples, expected=None, delay=0.0):
+    '''
+    离线回放：把样本依次交给滤波器，统计下发次数和跟踪误差。
+    下发的目标 delay 秒后才到达，误差为每个时刻已到达的目标与
+    expected 之间的夹角，默认 expected 为样本本身。
+    '''
+    attitude_filter.reset()
+    truth = R.from_euler('xyz', [s.attitude for s in (expected or samples)])
+    times, targets = [], []
+    for sample in samples:
+        out = attitude_filter.update(R.from_euler('xyz', sample.attitude), sample.immediately,
+                                     sample.timestamp)
+        if out is not None:
+            times.append(sample.timestamp + delay)
+            targets.append(out)
+    commands = len(targets)
+    errors = np.zeros(len(samples))
+    for i, sample in enumerate(samples):
+        j = bisect.bisect_right(times, sample.timestamp) - 1
+        if j >= 0:
+            errors[i] = _angle(targets[j], truth[i])
+    errors = np.degrees(errors)
+    duration = samples[-1].timestamp - samples[0].timestamp if samples else 0
+    return {
+        'commands': commands,
+        'per_second': commands / duration if duration else 0,
+        'mean_deg': errors.mean() if len(errors) else 0,
+        'p95_deg': np.percentile(errors, 95) if len(errors) else 0,
+        'max_deg': errors.max() if len(errors) else 0,
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='在录制的手机姿态上比较各种滤波器')
+    parser.add_argument('recording', nargs='?', help='recording.Recorder 的录制文件，不给时用模拟数据')
+    parser.add_argument('--filter', choices=FILTERS, action='append', help='默认比较所有滤波器')
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='滤波器参数，如 --option beta=4')
+    parser.add_argument('--delay', type=float, default=0.0, help='目标下发到机械臂转到位的时间（秒）')
+    parser.add_argument('--lookahead', type=float, nargs='*',
+                        help='同时比较这些外推时间（秒），不给值时用 --delay')
+    args = parser.parse_args(argv)
+    if args.recording:
+        samples, expected = read_samples(args.recording), None
+    else:
+        samples, expected = synthetic(), synthetic(jitter=0)
+    options = {k: float(v) for k, v in (o.split('=', 1) for o in args.option)}
+    lookaheads = [None]
+    if args.lookahead is not None:
+        lookaheads += args.lookahead or [args.delay]
+    print(f'{"filter":<10} {"ahead":>6} {"commands":>8} {"per s":>7} {"mean":>7} {"p95":>7} {"max":>7}')
+    for name in args.filter or FILTERS:
+        for lookahead in lookaheads:
+            predict = None if lookahead is None else {'lookahead': lookahead}
+            r = evaluate(make_filter(name, predict, **options), samples, expected, args.delay)
+            ahead = '-' if lookahead is None else f'{lookahead:.2f}'
+            print(f'{name:<10} {ahead:>6} {r["commands"]:>8} {r["per_second"]:7.2f} '
+                  f'{r["mean_deg"]:7.2f} {r["p95_deg"]:7.2f} {r["max_deg"]:7.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
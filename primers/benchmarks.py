@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import inspect
+import platform
+import timeit
+
+import numpy as np
+import scipy
+from scipy.spatial.transform import Rotation as R
+
+import kawasaki_robot
+import phone_protocol
+from kawasaki_robot import Robot, Coord, parse_status, parse_where, parse_io, parse_switch, is_running
+
+
+# 离线测速：数学和协议的热点路径，在不同批量下计时，结果存成 JSON 并与基线比较
+#
+#   python benchmarks.py --quick                    # 不跑 100000
+#   python benchmarks.py --save-baseline            # 记录基线
+#   python benchmarks.py                            # 与基线比较，变慢超过阈值时返回 1
+
+SIZES = (1, 20, 1000, 100000)
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+
+
+def _reply(doc):
+    # 把文档中的终端输出示例还原成控制器发来的 GBK 字节
+    return '\r\n'.join(inspect.cleandoc(doc).splitlines()).encode('GBK')
+
+
+STATUS_REPLY = _reply(Robot.get_status.__doc__)
+WHERE_REPLY = _reply(Robot.get_where.__doc__)
+IO_REPLY = _reply(parse_io.__doc__.split('：', 1)[1].split('返回')[0])
+SWITCH_REPLY = _reply(parse_switch.__doc__.split('：', 1)[1].split('返回')[0])
+PROGRESS_REPLY = b'PRINT progress\r\n-2\r\n>'
+
+
+def _poses(n, seed=0):
+    rng = np.random.default_rng(seed)
+    poses = np.empty((n, 6))
+    poses[:, :3] = rng.uniform(-1000, 1000, (n, 3))
+    poses[:, 3:] = rng.uniform(-180, 180, (n, 3))
+    return poses
+
+
+def _coord():
+    c = Coord()
+    c.place_object(800, 10, -100, 1, 50, 210)
+    c.ar, c.rr = 700, 0
+    return c
+
+
+def _noisy_orbit(n, seed=0):
+    poses = _coord().gen_world_n_batch(sv=10, sw=np.linspace(-90, 90, n))
+    return poses + np.random.default_rng(seed).normal(0, 1, poses.shape)
+
+
+CASES = {}
+
+
+def case(name):
+    # 注册一个测速项：setup(n) 返回一个处理 n 个位姿（或 n 条回复）的函数
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+@case('pose_human_to_kawasaki')
+def _(n):
+    poses = _poses(n).tolist()
+    return lambda: [kawasaki_robot.pose_human_to_kawasaki(p) for p in poses]
+
+
+@case('poses_human_to_kawasaki')
+def _(n):
+    poses = _poses(n)
+    return lambda: kawasaki_robot.poses_human_to_kawasaki(poses)
+
+
+@case('pose_kawasaki_to_human')
+def _(n):
+    poses = _poses(n).tolist()
+    return lambda: [kawasaki_robot.pose_kawasaki_to_human(p) for p in poses]
+
+
+@case('poses_kawasaki_to_human')
+def _(n):
+    poses = _poses(n)
+    return lambda: kawasaki_robot.poses_kawasaki_to_human(poses)
+
+
+@case('euler_rotation')
+def _(n):
+    uvw = _poses(n)[:, 3:]
+    xyz = np.tile([-700.0, 0, 0], (n, 1))
+    return lambda: kawasaki_robot.euler_rotation(uvw, xyz, degrees=True)
+
+
+@case('Coord.gen_world_n')
+def _(n):
+    c = _coord()
+    angles = _poses(n)[:, 3:].tolist()
+
+    def run():
+        for c.su, c.sv, c.sw in angles:
+            c.gen_world_n()
+    return run
+
+
+@case('Coord.gen_world_n_batch')
+def _(n):
+    c = _coord()
+    su, sv, sw = _poses(n)[:, 3:].T
+    return lambda: c.gen_world_n_batch(su=su, sv=sv, sw=sw)
+
+
+@case('Robot._multipose_move')
+def _(n):
+    # AS 语句的格式化，只写进 Program 缓冲区，不连网络
+    robot = Robot()
+    poses = _poses(n)
+
+    def run():
+        robot._edit_project('bench')
+        robot._multipose_move(poses, 'LMOVE')
+        return robot._end_edit()
+    return run
+
+
+@case('format_moves.per_pose')
+def _(n):
+    # 原来逐个位姿拼接 AS 语句的做法
+    poses = _poses(n)
+    return lambda: kawasaki_robot.format_moves_per_pose('LMOVE', poses)
+
+
+@case('format_moves')
+def _(n):
+    poses = _poses(n)
+    return lambda: kawasaki_robot.format_moves('LMOVE', poses)
+
+
+@case('format_moves.cmds')
+def _(n):
+    # 每个位姿一个指令，如 fit_arcs 的结果
+    poses = _poses(n)
+    cmds = np.resize(['JMOVE', 'LMOVE', 'C1MOVE', 'C2MOVE'], n).tolist()
+    return lambda: kawasaki_robot.format_moves(cmds, poses)
+
+
+@case('simplify_path')
+def _(n):
+    # 绕物体半圈的密集轨迹
+    poses = _coord().gen_world_n_batch(sv=10, sw=np.linspace(-90, 90, n))
+    return lambda: kawasaki_robot.simplify_path(poses, 1.0, 1.0)
+
+
+@case('simplify_path.noisy')
+def _(n):
+    # 同一条轨迹加上 1mm、1 度左右的噪声，几乎每个位姿都要保留，切分最深
+    poses = _noisy_orbit(n)
+    return lambda: kawasaki_robot.simplify_path(poses, 1.0, 1.0)
+
+
+@case('fit_arcs')
+def _(n):
+    poses = _coord().gen_world_n_batch(sv=10, sw=np.linspace(-90, 90, n))
+    return lambda: kawasaki_robot.fit_arcs(poses)
+
+
+@case('fit_arcs.noisy')
+def _(n):
+    # 加了噪声后几乎找不到圆弧，每个起点都要试一次
+    poses = _noisy_orbit(n)
+    return lambda: kawasaki_robot.fit_arcs(poses)
+
+
+@case('check_reach')
+def _(n):
+    poses = _coord().gen_world_n_batch(sv=10, sw=np.linspace(-180, 180, n))
+    return lambda: kawasaki_robot.check_reach(poses)
+
+
+@case('get_joint_and_pose.parse')
+def _(n):
+    replies = [WHERE_REPLY] * n
+    return lambda: [parse_where(r) for r in replies]
+
+
+@case('get_progress.parse')
+def _(n):
+    replies = [PROGRESS_REPLY] * n
+    return lambda: [int(r.split(b'\n')[-2]) for r in replies]
+
+
+@case('get_phone_uvw.json')
+def _(n):
+    # 原来手机发送的 JSON，每次 recv 解码一条
+    messages = [json.dumps({'attitude': list(p[3:]), 'immediately': False}).encode('utf-8')
+                for p in _poses(n)]
+    return lambda: [json.loads(m.decode('utf-8'))['attitude'] for m in messages]
+
+
+@case('get_phone_uvw.frames')
+def _(n):
+    data = b''.join(phone_protocol.pack(i, i * 0.01, p[3:], False) for i, p in enumerate(_poses(n)))
+    return lambda: phone_protocol.FrameDecoder().feed(data)
+
+
+def measure(func, min_time=0.2, repeat=3):
+    # 每次调用的秒数，取 repeat 次中最快的一次
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange() if min_time else (1, None)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(sizes=SIZES, names=None, min_time=0.2, out=sys.stdout):
+    results = {}
+    for name, setup in CASES.items():
+        if names and not any(x in name for x in names):
+            continue
+        for n in sizes:
+            t = measure(setup(n), min_time if n < 100000 else 0, repeat=3 if n < 100000 else 1)
+            results[f'{name}[{n}]'] = t
+            print(f'{name:<32} {n:>7} {t * 1e3:12.4f} ms {t / n * 1e6:10.3f} us/item', file=out)
+    return results
+
+
+def meta():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'machine': platform.machine(),
+        'node': platform.node(),
+    }
+
+
+def compare(results, baseline, threshold=1.5, out=sys.stdout):
+    # 返回变慢超过 threshold 倍的项
+    slower = []
+    for key, t in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        ratio = t / base
+        flag = ''
+        if ratio > threshold:
+            flag = '  <-- 变慢'
+            slower.append(key)
+        print(f'{key:<44} {ratio:6.2f}x{flag}', file=out)
+    return slower
+
+
+def bench_parsers():
+    # 原来的做法：解码整段回复再查找
+    for name, func in (
+            ('is_moving (decode)', lambda: '程序运行中' in STATUS_REPLY.decode('GBK')),
+            ('is_moving (is_running)', lambda: is_running(STATUS_REPLY)),
+            ('parse_status', lambda: parse_status(STATUS_REPLY)),
+            ('parse_where', lambda: parse_where(WHERE_REPLY)),
+            ('get_io (decode)', lambda: IO_REPLY.decode('GBK')),
+            ('parse_io', lambda: parse_io(IO_REPLY)),
+            ('get_switch (decode)', lambda: SWITCH_REPLY.decode('GBK')),
+            ('parse_switch', lambda: parse_switch(SWITCH_REPLY))):
+        print(f'{name:<40} {measure(func) * 1e6:10.2f} us')
+
+
+def check_parsers():
+    status = parse_status(STATUS_REPLY)
+    assert not status.running
+    assert status.monitor_speed == 20.0
+    assert status.program_speed == (100.0, 100.0)
+    assert (status.completed, status.remaining) == (1, 0)
+    assert (status.program, status.priority, status.step) == ('multipose_move', 0, 4)
+    assert status.statement.startswith('JMOVE TRANS(')
+    where = parse_where(WHERE_REPLY)
+    assert where.joints[0] == -6.552 and where.pose[-1] == 46.437
+    # 最后一行没有换行
+    assert parse_where(WHERE_REPLY.rsplit(b'\r\n', 1)[0]) == where
+    io = parse_io(IO_REPLY)
+    assert [n for n in range(1, 1033) if kawasaki_robot.io_signal(io, n)] == [1, 2, 3, 1001]
+    assert parse_switch(SWITCH_REPLY)['CP'] is True
+
+
+def check_paths():
+    # 原地转动：位置不变只改姿态，不能拟合成圆弧，也不能被简化掉
+    poses = np.zeros((7, 6))
+    poses[:, 0] = 1000
+    poses[:, 5] = np.linspace(0, 90, 7)
+    assert kawasaki_robot.fit_arcs(poses) == [('MOVE', i) for i in range(7)]
+    assert kawasaki_robot.simplify_path(poses).saved == 5
+    # 容差为 0：直线上姿态不变，中间的位姿都可以去掉
+    poses = np.zeros((10, 6))
+    poses[:, 0] = np.linspace(0, 1000, 10)
+    for tol in ((1, 0), (0, 1), (0, 0)):
+        assert kawasaki_robot.simplify_path(poses, *tol).saved == 8
+
+
+def check_kinematics():
+    # Robot.get_where 文档里控制器的回复：姿态与连杆长度无关，正解应得到回复里的 OAT；
+    # 连杆长度是近似值（见 rs10），位置还没有多组回复可以核对
+    where = parse_where(WHERE_REPLY)
+    pose = kawasaki_robot.poses_human_to_kawasaki(kawasaki_robot.forward_kinematics(where.joints))[0]
+    oat = R.from_euler('ZYZ', [pose[3:], where.pose[3:]], degrees=True)
+    assert np.degrees((oat[0].inv() * oat[1]).magnitude()) < 0.2
+    # 逆解与正解一致：限位内的几组关节角（正面、肘部在上、UWRIST）正解后再逆解
+    joints = np.array([where.joints, (0, 10, -90, 0, 60, 0), (30, 40, -60, 45, 30, -20),
+                       (-120, -20, -120, -90, 60, 170)])
+    reach = kawasaki_robot.check_reach(kawasaki_robot.forward_kinematics(joints))
+    assert reach.reachable.all() and np.allclose(reach.joints, joints, atol=1e-6)
+
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='数学和协议热点路径的离线测速')
+    parser.add_argument('cases', nargs='*', help='只跑名字中包含这些字符串的项')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--quick', action='store_true', help='不跑 100000')
+    parser.add_argument('--json', help='结果写到这个文件')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=1.5)
+    parser.add_argument('--parsers', action='store_true', help='只跑回复解析的单次测速')
+    args = parser.parse_args(argv)
+
+    check_parsers()
+    check_paths()
+    check_kinematics()
+    if args.parsers:
+        bench_parsers()
+        return 0
+    sizes = [n for n in args.sizes if not (args.quick and n >= 100000)]
+    report = {'meta': meta(), 'results': run(sizes, args.cases)}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('baseline:', args.baseline)
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print('\ncompare with', args.baseline)
+        if compare(report['results'], baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
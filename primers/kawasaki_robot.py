@@ -1,10 +1,15 @@
+import re
 import sys
 import json
 import time
 import socket
+import selectors
+import threading
+import concurrent.futures
 import math
 from math import sin, cos
 from math import *
+from collections import namedtuple
 
 import numpy as np
 from scipy.spatial.transform import Rotation as R
@@ -18,25 +23,598 @@ def euler_rotation(uvw, xyz, degrees=False):
 rs10 = {                        # rs10 基卡特
     'r15': 1400,                # 作用区间
     'cea': 35.9 / 50 * 9 / 16,  # 相机焦距的相关参数  0.20
+    'v_max': 1000,              # 速度 100% 时末端的大致速度 mm/s，用来估计运动时间
+    'w_max': 180,               # 速度 100% 时姿态的大致角速度 deg/s
+    # 运动学参数（mm），按 RS010N 的规格（最大可达 1450mm）估计的近似值，还没有用多组
+    # WHERE 的回复核对过，check_reach 只能作参考；关节的方向按 WHERE 的回复确定
+    # （见 benchmarks.check_kinematics）：JT1 为 0 时手臂朝向基座坐标系的 +Y，JT1 增大时顺时针转
+    'd1': 430,                  # JT2 轴离基座原点的高度
+    'a1': 100,                  # JT2 轴离 JT1 轴的水平距离
+    'a2': 600,                  # 大臂 JT2 -> JT3
+    'a3': 100,                  # JT3 轴到小臂轴线的偏置
+    'd4': 650,                  # 小臂 JT3 -> 手腕中心
+    'd6': 100,                  # 手腕中心 -> 法兰
+    'limits': ((-180, 180), (-105, 145), (-163, 150), (-270, 270), (-145, 145), (-360, 360)),
 }
 
 
+_X180 = R.from_euler('x', 180, degrees=True)
+_X180_INV = R.from_euler('x', -180, degrees=True)   # _X180.inv()
+
+
+def poses_human_to_kawasaki(poses):
+    # (N, 6) -> (N, 6)，一次转换整条轨迹
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    out = np.empty_like(poses)
+    out[:, 0] = -poses[:, 1]
+    out[:, 1] = poses[:, 0]
+    out[:, 2] = poses[:, 2]
+    if len(poses):
+        u, v, w = poses[:, 3], poses[:, 4], poses[:, 5]
+        m1 = R.from_euler('zxy', np.stack((-w, v, -u), axis=1), degrees=True)
+        out[:, 3:] = (m1 * _X180).as_euler('zyz', degrees=True)
+    return out
+
+
+def poses_kawasaki_to_human(poses):
+    # (N, 6) -> (N, 6)，一次转换整条轨迹
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    out = np.empty_like(poses)
+    out[:, 0] = poses[:, 1]
+    out[:, 1] = -poses[:, 0]
+    out[:, 2] = poses[:, 2]
+    if len(poses):
+        m3 = R.from_euler('zyz', poses[:, 3:], degrees=True)
+        wvu = (m3 * _X180_INV).as_euler('zxy', degrees=True)
+        out[:, 3] = -wvu[:, 2]
+        out[:, 4] = wvu[:, 1]
+        out[:, 5] = -wvu[:, 0]
+    return out
+
+
 def pose_human_to_kawasaki(pose):
-    x, y, z, u, v, w = pose
-    x, y, z = -y, x, z
-    m1 = R.from_euler('zxy', (-w, v, -u), degrees=True)
-    m2 = R.from_euler('x', 180, degrees=True)
-    u, v, w = (m1 * m2).as_euler('zyz', degrees=True)
-    return x, y, z, u, v, w
+    return tuple(poses_human_to_kawasaki(pose)[0].tolist())
 
 
 def pose_kawasaki_to_human(pose):
-    x, y, z, u, v, w = pose
-    x, y, z = y, -x, z
-    m3 = R.from_euler('zyz', (u, v, w), degrees=True)
-    m2 = R.from_euler('x', -180, degrees=True)  # m2.inv()
-    w, v, u = (m3 * m2).as_euler('zxy', degrees=True)
-    return [x, y, z, -u, v, -w]
+    return poses_kawasaki_to_human(pose)[0].tolist()
+
+
+HUMAN, KAWASAKI = 'human', 'kawasaki'
+
+
+class Pose:
+    '''
+    一个位姿 (x, y, z, u, v, w)，frame 标明坐标系的约定：
+        human       人的坐标系（前上左，xyz 欧拉角），Coord、draw 等用的都是它
+        kawasaki    控制器的坐标系（TRANS 的 X Y Z O A T）
+    不可变，修改用 replace；可以当作 6 个数的序列使用。
+    '''
+
+    __slots__ = ('values', 'frame')
+
+    def __init__(self, x=0, y=0, z=0, u=0, v=0, w=0, frame=HUMAN):
+        if frame not in (HUMAN, KAWASAKI):
+            raise ValueError(f'unknown frame: {frame}')
+        self.values = (float(x), float(y), float(z), float(u), float(v), float(w))
+        self.frame = frame
+
+    @classmethod
+    def of(cls, pose, frame=HUMAN):
+        # Pose 原样返回，其他 6 个数的序列按 frame 包装
+        if isinstance(pose, Pose):
+            return pose
+        return cls(*pose, frame=frame)
+
+    x = property(lambda self: self.values[0])
+    y = property(lambda self: self.values[1])
+    z = property(lambda self: self.values[2])
+    u = property(lambda self: self.values[3])
+    v = property(lambda self: self.values[4])
+    w = property(lambda self: self.values[5])
+
+    def human(self):
+        if self.frame == HUMAN:
+            return self
+        return Pose(*poses_kawasaki_to_human(self.values)[0], frame=HUMAN)
+
+    def kawasaki(self):
+        if self.frame == KAWASAKI:
+            return self
+        return Pose(*poses_human_to_kawasaki(self.values)[0], frame=KAWASAKI)
+
+    def replace(self, **fields):
+        values = dict(zip('xyzuvw', self.values))
+        values.update(fields)
+        return Pose(**values, frame=self.frame)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.values, dtype=dtype)
+
+    def __eq__(self, other):
+        return isinstance(other, Pose) and self.frame == other.frame and self.values == other.values
+
+    def __hash__(self):
+        return hash((self.values, self.frame))
+
+    def __repr__(self):
+        return f'Pose({", ".join(map(repr, self.values))}, frame={self.frame!r})'
+
+
+class Trajectory:
+    '''
+    一串位姿，存成一个连续的 (N, 6) float64 数组，坐标系约定同 Pose。
+    转换和生成 AS 语句都对整个数组进行，不产生逐个位姿的 Python 对象。
+    '''
+
+    __slots__ = ('array', 'frame')
+
+    def __init__(self, poses=(), frame=HUMAN):
+        if frame not in (HUMAN, KAWASAKI):
+            raise ValueError(f'unknown frame: {frame}')
+        if len(poses) and isinstance(poses[0], Pose):
+            convert = Pose.human if frame == HUMAN else Pose.kawasaki
+            poses = [convert(p).values for p in poses]
+        self.array = np.ascontiguousarray(poses, dtype=float).reshape(-1, 6)
+        self.frame = frame
+
+    @classmethod
+    def of(cls, poses, frame=HUMAN):
+        # Trajectory 原样返回，Pose 变成一个位姿的轨迹，其他按 frame 包装
+        if isinstance(poses, Trajectory):
+            return poses
+        if isinstance(poses, Pose):
+            return cls(np.array(poses.values), poses.frame)
+        return cls(poses, frame)
+
+    def human(self):
+        if self.frame == HUMAN:
+            return self
+        return Trajectory(poses_kawasaki_to_human(self.array), HUMAN)
+
+    def kawasaki(self):
+        if self.frame == KAWASAKI:
+            return self
+        return Trajectory(poses_human_to_kawasaki(self.array), KAWASAKI)
+
+    def statements(self, cmd):
+        # 每个位姿一条 cmd TRANS(...) 语句，整段返回 bytes
+        return format_moves(cmd, self.kawasaki().array)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return Pose(*self.array[i], frame=self.frame)
+        return Trajectory(self.array[i], self.frame)
+
+    def __iter__(self):
+        for row in self.array.tolist():
+            yield Pose(*row, frame=self.frame)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __repr__(self):
+        return f'Trajectory({len(self)} poses, frame={self.frame!r})'
+
+
+def human_poses(poses):
+    # Pose、Trajectory、数组或位姿列表 -> 人的坐标系的 (N, 6) 数组
+    return Trajectory.of(poses).human().array
+
+
+# AS 语句里的数：保留 3 位小数，去掉末尾多余的 0，与 str(round(x, 3)) 的结果相同
+# （'%.3f' 与 round 一样按二进制的精确值舍入；1e12 以上相邻浮点数的间隔接近 0.001，
+#  str 给出的最短表示可能更短，不走这条路）
+_FAST_LIMIT = 1e12
+
+
+def _number(x):
+    if isinstance(x, int):
+        return str(int(x))
+    s = ('%.3f' % x).rstrip('0')
+    return s + '0' if s.endswith('.') else s
+
+
+def format_numbers(values):
+    # 一组数 -> 'a, b, c'，整数原样输出（如 DRAW 的默认参数 0）
+    if all(abs(x) < _FAST_LIMIT for x in values):
+        return ', '.join(_number(x) for x in values)
+    return ', '.join(str(round(x, 3)) for x in values)
+
+
+def format_moves_per_pose(cmd, poses):
+    # 逐个位姿拼接的原始做法，format_moves 的参照
+    cmds = [cmd] * len(poses) if isinstance(cmd, str) else cmd
+    return ''.join(f'{c} TRANS({", ".join(str(round(x, 3)) for x in pose)})\n'
+                   for c, pose in zip(cmds, np.asarray(poses).tolist())).encode()
+
+
+def _decimals(poses):
+    # 每个数按 '%.3f' 格式化、去掉末尾的 0 之后剩下的小数位数（1~3）
+    scaled = poses * 1000
+    m = np.rint(scaled)
+    decimals = np.where(m % 10 != 0, 3, np.where(m % 100 != 0, 2, 1))
+    # 乘 1000 有舍入误差，离 .5 太近的数按 '%.3f' 的结果逐个确认
+    near = np.abs(scaled - np.floor(scaled) - 0.5) <= np.abs(scaled) * 1e-15 + 1e-12
+    for i in zip(*np.nonzero(near)):
+        s = _number(float(poses[i]))
+        decimals[i] = len(s) - s.index('.') - 1
+    return decimals
+
+
+# format_moves 的格式：_MOVE_FORMATS[j, d] 为第 j 列保留 d 位小数，第 0 列前面是指令
+_MOVE_FORMATS = np.array([[f'{sep}%.{d}f{tail}' for d in range(4)]
+                          for sep, tail in [('%s TRANS(', '')] + [(', ', '')] * 4 + [(', ', ')\n')]],
+                         dtype=object)
+
+
+def format_moves(cmd, poses):
+    '''
+    控制器坐标系的 (N, 6) 数组 -> 每个位姿一条 TRANS 运动语句，整段 bytes。
+    cmd 为一个指令（如 'LMOVE'），或每个位姿一个指令（JMOVE/LMOVE/C1MOVE/C2MOVE）。
+
+    先用 numpy 算出每个数要保留几位小数，拼成整段的格式串，再一次 % 格式化，
+    不需要事后去掉多余的 0；结果与 format_moves_per_pose 逐字节相同。
+    '''
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    n = len(poses)
+    if not n:
+        return b''
+    if not np.all(np.abs(poses) < _FAST_LIMIT):
+        # 含 nan、inf 或特别大的数
+        return format_moves_per_pose(cmd, poses)
+    if not isinstance(cmd, str) and len(cmd) != n:
+        raise ValueError(f'{len(cmd)} commands for {n} poses')
+    template = ''.join(_MOVE_FORMATS[np.arange(6), _decimals(poses)].ravel().tolist())
+    if isinstance(cmd, str):
+        # 只有一个指令时直接写进格式串
+        template, values = template.replace('%s', cmd.replace('%', '%%')), poses.ravel().tolist()
+    else:
+        rows = np.empty((n, 7), dtype=object)
+        rows[:, 0] = cmd
+        rows[:, 1:] = poses.tolist()
+        values = rows.ravel().tolist()
+    return (template % tuple(values)).encode()
+
+
+def draw_pose(pose, x=0, y=0, z=0, u=0, v=0, w=0):
+    # 相对世界坐标系移动后的位姿，传入 Pose 时返回 Pose
+    if isinstance(pose, Pose):
+        return Pose(*draw_pose(list(pose.human()), x, y, z, u, v, w))
+    pose = list(pose)
+    pose[0] += x
+    pose[1] += y
+    pose[2] += z
+
+    m1 = R.from_euler('xyz', (u, v, w), degrees=True)
+    m2 = R.from_euler('xyz', pose[3:], degrees=True)
+    pose[3:] = (m1 * m2).as_euler('xyz', degrees=True)
+    return pose
+
+
+def tdraw_pose(pose, x=0, y=0, z=0, u=0, v=0, w=0):
+    # 相对相机坐标系移动后的位姿，传入 Pose 时返回 Pose
+    if isinstance(pose, Pose):
+        return Pose(*tdraw_pose(list(pose.human()), x, y, z, u, v, w))
+    pose = list(pose)
+    x, y, z = R.from_euler('xyz', pose[3:], degrees=True).apply([x, y, z])
+    pose[0] += x
+    pose[1] += y
+    pose[2] += z
+
+    m1 = R.from_euler('xyz', (u, v, w), degrees=True)
+    m2 = R.from_euler('xyz', pose[3:], degrees=True)
+    pose[3:] = (m2 * m1).as_euler('xyz', degrees=True)
+    return pose
+
+
+Simplified = namedtuple('Simplified', (
+    'poses',            # 保留下来的位姿 (M, 6)
+    'index',            # 保留的位姿在原数组中的下标
+    'saved',            # 省掉的运动语句数
+    'max_mm',           # 去掉的位姿离新路径最远的距离
+    'max_deg',          # 去掉的位姿与新路径上对应姿态的最大夹角
+))
+
+
+def _slerp_angle(qa, qb, t, q):
+    # 从 qa 到 qb 按比例 t 球面插补得到的姿态与 q 的夹角（度），四元数为 (..., 4) 的数组
+    dot = np.sum(qa * qb, axis=-1)
+    qb = np.where(np.expand_dims(dot < 0, -1), -qb, qb)
+    omega = np.arccos(np.clip(np.abs(dot), 0, 1))
+    s = np.sin(omega)
+    small = s < 1e-9        # 两个姿态几乎相同
+    s = np.where(small, 1, s)
+    w1 = np.where(small, 1 - t, np.sin((1 - t) * omega) / s)
+    w2 = np.where(small, t, np.sin(t * omega) / s)
+    expected = w1[..., None] * qa + w2[..., None] * qb
+    expected /= np.linalg.norm(expected, axis=-1, keepdims=True)
+    return np.degrees(2 * np.arccos(np.clip(np.abs(np.sum(expected * q, axis=-1)), 0, 1)))
+
+
+def _segment_deviation(pos, quat, a, b, i):
+    # 位姿 i 到直线插补路径 a -> b 的位置偏差（mm）和姿态偏差（度），a、b、i 为等长的下标数组
+    d = pos[b] - pos[a]
+    length2 = np.sum(d * d, axis=1)
+    moving = length2 > 1e-12
+    t = np.sum((pos[i] - pos[a]) * d, axis=1) / np.where(moving, length2, 1)
+    t = np.where(moving, np.clip(t, 0, 1), (i - a) / (b - a))     # 原地转动，按先后顺序插补
+    mm = np.linalg.norm(pos[a] + t[:, None] * d - pos[i], axis=1)
+    return mm, _slerp_angle(quat[a], quat[b], t, quat[i])
+
+
+def _over(deviation, tol):
+    # 偏差与容差之比；容差为 0 时没有偏差为 0，有偏差为 inf（不出现 0 / 0），
+    # 1e-5 以下（mm 或度）算作浮点误差
+    if tol > 0:
+        return deviation / tol
+    return np.where(deviation > 1e-5, np.inf, 0.0)
+
+
+def simplify_path(poses, tol_mm=1.0, tol_deg=1.0):
+    '''
+    去掉中间的位姿，使原来每个位姿离简化后的路径（相邻保留点之间直线插补，
+    姿态按球面插补）都不超过 tol_mm 和 tol_deg，首尾总是保留。
+
+    按 Douglas-Peucker 的方式在偏差最大处切分。每一轮同时处理所有待切分的段，
+    一次算完这些段内全部位姿的偏差，轮数只与切分的深度有关。
+    JMOVE 在关节空间插补，这里的偏差只是近似。
+    '''
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    n = len(poses)
+    if n < 3:
+        return Simplified(poses, np.arange(n), 0, 0.0, 0.0)
+    pos = poses[:, :3]
+    quat = R.from_euler('xyz', poses[:, 3:], degrees=True).as_quat()
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    max_mm = max_deg = 0.0
+    a, b = np.array([0]), np.array([n - 1])
+    while len(a):
+        # 各段内的位姿排在一起，seg 为所属的段，start 为每段的起始位置
+        count = b - a - 1
+        start = np.cumsum(count) - count
+        seg = np.repeat(np.arange(len(a)), count)
+        i = np.arange(len(seg)) - start[seg] + a[seg] + 1
+        mm, deg = _segment_deviation(pos, quat, a[seg], b[seg], i)
+        score = np.maximum(_over(mm, tol_mm), _over(deg, tol_deg))
+        best = np.maximum.reduceat(score, start)
+        done = best <= 1
+        if done.any():
+            max_mm = max(max_mm, np.maximum.reduceat(mm, start)[done].max())
+            max_deg = max(max_deg, np.maximum.reduceat(deg, start)[done].max())
+        # 其余的段在第一个偏差最大的位姿处切成两段
+        first = np.flatnonzero(score == best[seg])
+        _, k = np.unique(seg[first], return_index=True)
+        split = i[first[k]][~done]
+        keep[split] = True
+        a, b = np.concatenate((a[~done], split)), np.concatenate((split, b[~done]))
+        longer = b - a > 1
+        a, b = a[longer], b[longer]
+    index = np.flatnonzero(keep)
+    return Simplified(poses[index], index, n - len(index), float(max_mm), float(max_deg))
+
+
+def _arc_scores(pos, quat, a, b, tol_mm, tol_deg, max_arc):
+    # 对每一对下标 a < b（数组），a..b 各位姿落在过 a、中点、b 三点的圆弧上的程度，
+    # <= 1 为都在容差内，不成圆弧时为 inf
+    # 短的区间用 b 补齐到同样长，重复的终点不影响结果
+    if not len(a):
+        return np.empty(0)
+    idx = np.minimum(a[:, None] + np.arange((b - a).max() + 1), b[:, None])
+    start, middle, end = pos[a], pos[(a + b) // 2], pos[b]
+    u, v = middle - start, end - start
+    n = np.cross(u, v)
+    nn, uu, vv = np.sum(n * n, axis=1), np.sum(u * u, axis=1), np.sum(v * v, axis=1)
+    flat = nn <= 1e-12 * uu * vv        # 三点共线或重合（原地转动）
+    nn = np.where(flat, 1, nn)
+    center = start + (uu[:, None] * np.cross(v, n) + vv[:, None] * np.cross(n, u)) / (2 * nn[:, None])
+    n = n / np.sqrt(nn)[:, None]
+    e1 = start - center
+    radius = np.linalg.norm(e1, axis=1)
+    e1 = e1 / np.where(radius > 0, radius, 1)[:, None]
+    e2 = np.cross(n, e1)
+    p = pos[idx] - center[:, None]
+    x, y, h = (np.sum(p * e[:, None], axis=2) for e in (e1, e2, n))
+    # 沿 a -> 中点 -> b 的方向（绕 n 逆时针）角度单调增加
+    theta = np.arctan2(y, x) % (2 * np.pi)
+    theta[:, 0] = 0
+    bad = flat | (theta[:, -1] > np.radians(max_arc)) | np.any(np.diff(theta, axis=1) < -1e-9, axis=1)
+    mm = np.hypot(h, np.hypot(x, y) - radius[:, None])
+    t = theta / np.where(theta[:, -1] > 0, theta[:, -1], 1)[:, None]
+    deg = _slerp_angle(quat[a][:, None], quat[b][:, None], t, quat[idx])
+    score = np.maximum(mm.max(axis=1) / tol_mm, deg.max(axis=1) / tol_deg)
+    return np.where(bad, np.inf, score)
+
+
+def fit_arcs(poses, tol_mm=1.0, tol_deg=1.0, max_arc=180):
+    '''
+    把位姿序列拆成圆弧和直线：连续若干位姿都在同一个圆上（容差 tol_mm、tol_deg）时
+    用一对 C1MOVE（弧的中点）、C2MOVE（弧的终点）代替，其余保持直线运动。
+
+    返回 [(指令, 下标), ...]，第一项是起点，指令为 'MOVE'（由调用者决定 LMOVE 或 JMOVE）、
+    'C1MOVE' 或 'C2MOVE'。每段圆弧不超过 max_arc 度，至少要省掉一条语句才用圆弧。
+
+    从每个起点贪心地找最长的圆弧：先按倍数往后试，再在最后一个成功和第一个失败之间二分。
+    每次尝试都是对整段重新计算，所以尽量把要试的终点放在一次 numpy 计算里。
+    '''
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    n = len(poses)
+    if not n:
+        return []
+    pos = poses[:, :3]
+    quat = R.from_euler('xyz', poses[:, 3:], degrees=True).as_quat()
+
+    def fits(a, ends):
+        return _arc_scores(pos, quat, np.full(len(ends), a), ends, tol_mm, tol_deg, max_arc) <= 1
+
+    # 最短的圆弧（4 个位姿）对所有起点一次算完，不成弧的起点不必再逐个尝试
+    starts = np.arange(max(n - 3, 0))
+    shortest = _arc_scores(pos, quat, starts, starts + 3, tol_mm, tol_deg, max_arc) <= 1
+    moves = [('MOVE', 0)]
+    a = 0
+    while a < n - 1:
+        if a + 3 >= n or not shortest[a]:
+            a += 1
+            moves.append(('MOVE', a))
+            continue
+        known = {a + 3: True}
+
+        def fit(b):
+            # 没算过的终点：要算的位姿不多时把 good 之后、bad 之前，至少到 a + 16 的终点
+            # 一次算完，后面的倍增和二分多半不必再算
+            if b not in known:
+                ends = np.arange(good + 1, min(max(b, a + 16), bad - 1) + 1)
+                if len(ends) * (ends[-1] - a) > 1 << 14:
+                    ends = np.array([b])
+                known.update(zip(ends.tolist(), fits(a, ends).tolist()))
+            return known[b]
+
+        # 先按倍数往后试，再在最后一个成功和第一个失败之间二分
+        good, bad, step = a + 3, n, 6
+        while a + step < n and fit(a + step):
+            good, step = a + step, step * 2
+        bad = min(a + step, n)
+        while bad - good > 1:
+            b = (good + bad) // 2
+            if fit(b):
+                good = b
+            else:
+                bad = b
+        moves.append(('C1MOVE', (a + good) // 2))
+        moves.append(('C2MOVE', good))
+        a = good
+    return moves
+
+
+# 手腕 JT4 JT6 绕小臂轴线（x），JT5 绕 -y，法兰 z 轴在零位时沿小臂方向、x 轴朝下
+# 控制器的 OAT 是内旋的 ZYZ（Rotation 的 'ZYZ'）
+_FLANGE = R.from_euler('YZ', (90, -90), degrees=True)
+
+Reach = namedtuple('Reach', (
+    'ok',               # 每个位姿是否可以运动到
+    'joints',           # 逆解的关节角 (N, 6)，度
+    'reachable',        # 手腕中心在大臂小臂可达的范围内，且末端在 r15 之内
+    'in_limits',        # 关节角都在 limits 之内
+    'wrist',            # 1 为 UWRIST（JT5 > 0），-1 为 DWRIST
+    'singular',         # JT5 接近 0，手腕奇异
+    'flip',             # 与上一个位姿相比手腕形态改变，或 JT4、JT6 跳变
+))
+
+
+def _wrap(deg):
+    return (deg + 180) % 360 - 180
+
+
+def forward_kinematics(joints, params=rs10, tool=(0, 0, 0)):
+    # 关节角 (N, 6) -> 人的坐标系的位姿 (N, 6)，tool 与 Robot.tool 的参数相同
+    joints = np.radians(np.asarray(joints, dtype=float).reshape(-1, 6))
+    t1, t2, t3 = joints[:, 0], joints[:, 1], joints[:, 2]
+    # phi 为小臂向下偏离水平面的角度，JT3 为 0 时小臂与大臂在一条直线上
+    azimuth, phi = np.pi / 2 - t1, t2 - t3 - np.pi / 2
+    r = params['a1'] + params['a2'] * np.sin(t2) + params['a3'] * np.sin(phi) + params['d4'] * np.cos(phi)
+    z = params['d1'] + params['a2'] * np.cos(t2) + params['a3'] * np.cos(phi) - params['d4'] * np.sin(phi)
+    wc = np.stack((r * np.cos(azimuth), r * np.sin(azimuth), z), axis=1)
+    arm = R.from_euler('ZY', np.stack((azimuth, phi), axis=1))
+    wrist = joints[:, 3:] * [1, -1, 1]
+    flange = arm * R.from_euler('XYX', wrist) * _FLANGE
+    x, y, z = tool
+    out = np.empty_like(joints)
+    out[:, :3] = wc + flange.apply([0, 0, params['d6']]) + flange.apply([-y, x, z])
+    out[:, 3:] = flange.as_euler('ZYZ', degrees=True)
+    return poses_kawasaki_to_human(out)
+
+
+def _rot(axis, angle):
+    # 绕坐标轴旋转的矩阵 (N, 3, 3)，angle 为弧度
+    c, s = np.cos(angle), np.sin(angle)
+    m = np.zeros((len(angle), 3, 3))
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    m[:, axis, axis] = 1
+    m[:, i, i] = m[:, j, j] = c
+    m[:, j, i] = s
+    m[:, i, j] = -s
+    return m
+
+
+def check_reach(poses, params=rs10, tool=(0, 0, 0), wrist='UWRIST', singular=5, flip=90):
+    '''
+    上传前一次检查整条轨迹：RS10 的解析逆解、作用区间和关节限位，
+    以及手腕奇异和形态变化（UWRIST/DWRIST 切换、JT4 JT6 跳变超过 flip 度）。
+    只取正面（JT1 朝向手腕中心）、肘部在上的解，wrist 为优先的手腕形态，
+    超出限位时才换另一种。连杆长度是近似值（见 rs10），结果只能作参考，以控制器为准，
+    不要用来拒绝上传。
+
+    旋转直接用 numpy 矩阵计算，不经过 Rotation，几千个位姿只要几毫秒。
+    '''
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    n = len(poses)
+    lo, hi = np.array(params['limits'], dtype=float).T
+    # 人的坐标系 -> 机械臂的坐标系，同 poses_human_to_kawasaki
+    # 得到的是把 OAT 当作外旋 zyz 的矩阵，x 轴转 180 度共轭、转置后就是内旋的 ZYZ
+    u, v, w = np.radians(poses[:, 3:]).T
+    x180 = _X180.as_matrix()
+    flange = x180 @ (_rot(1, -u) @ _rot(0, v) @ _rot(2, -w) @ x180).transpose(0, 2, 1) @ x180
+    pos = np.stack((-poses[:, 1], poses[:, 0], poses[:, 2]), axis=1)
+    x, y, z = tool
+    wc = pos - flange @ np.array([-y, x, z + params['d6']], dtype=float)
+
+    # 大臂小臂：在 JT1 转过的平面内解三角形
+    azimuth = np.arctan2(wc[:, 1], wc[:, 0])
+    t1 = np.arctan2(wc[:, 0], wc[:, 1])     # pi / 2 - azimuth
+    r = np.hypot(wc[:, 0], wc[:, 1]) - params['a1']
+    h = wc[:, 2] - params['d1']
+    a2 = params['a2']
+    length = np.hypot(params['a3'], params['d4'])
+    beta = np.arctan2(params['a3'], params['d4'])
+    c = (r * r + h * h - a2 * a2 - length * length) / (2 * a2 * length)
+    reachable = (np.abs(c) <= 1) & (np.hypot(pos[:, 0], pos[:, 1]) <= params['r15'])
+    delta = np.arcsin(np.clip(c, -1, 1))
+    p, q = a2 + length * np.sin(delta), length * np.cos(delta)
+    t2 = np.arctan2(r, h) - np.arctan2(q, p)
+    phi = t2 + beta - delta
+    t3 = t2 - phi - np.pi / 2
+
+    # 手腕：小臂坐标系下 Rx(JT4) Ry(-JT5) Rx(JT6)，JT5 >= 0 为 UWRIST
+    arm = _rot(2, azimuth) @ _rot(1, phi)
+    m = arm.transpose(0, 2, 1) @ flange @ _FLANGE.as_matrix().T
+    down = np.degrees(np.stack((
+        np.arctan2(m[:, 1, 0], -m[:, 2, 0]),
+        -np.arccos(np.clip(m[:, 0, 0], -1, 1)),
+        np.arctan2(m[:, 0, 1], m[:, 0, 2])), axis=1))
+    up = np.stack((_wrap(down[:, 0] + 180), -down[:, 1], _wrap(down[:, 2] + 180)), axis=1)
+
+    joints = np.empty((n, 6))
+    joints[:, 0] = np.degrees(t1)
+    joints[:, 1] = np.degrees(t2)
+    joints[:, 2] = np.degrees(t3)
+    first, second = (up, down) if wrist == 'UWRIST' else (down, up)
+
+    def within(j):
+        return np.all((j >= lo[3:]) & (j <= hi[3:]), axis=1)
+
+    use_first = within(first) | ~within(second)
+    joints[:, 3:] = np.where(use_first[:, None], first, second)
+    in_limits = np.all((joints >= lo) & (joints <= hi), axis=1)
+    sign = np.where(joints[:, 4] >= 0, 1, -1)
+    singular = np.abs(joints[:, 4]) < singular
+    jump = np.zeros(n, dtype=bool)
+    jump[1:] = (sign[1:] != sign[:-1]) | np.any(
+        np.abs(_wrap(np.diff(joints[:, [3, 5]], axis=0))) > flip, axis=1)
+    ok = reachable & in_limits
+    return Reach(ok, joints, reachable, in_limits, sign, singular, jump)
 
 
 class Coord:
@@ -76,30 +654,386 @@ class Coord:
         # 编辑输出
         return [x, y, z, u, v, w]
 
+    def gen_world_n_batch(self, **params):
+        '''
+        批量版的 gen_world_n，返回 (N, 6) 的位姿数组。
 
-class Robot:
+        ax ay az rx ry rz su sv sw ar rr 均可传入数组（按广播规则对齐），
+        未传入的沿用当前属性值，例如绕物体一圈 360 个视点：
 
-    def __init__(self, timeout=0.5):
-        self.timeout = timeout
-        self.debug = False
+            c.gen_world_n_batch(sv=10, sw=np.linspace(-180, 180, 360))
+        '''
+        names = ('ax', 'ay', 'az', 'rx', 'ry', 'rz', 'su', 'sv', 'sw', 'ar', 'rr')
+        unknown = set(params) - set(names)
+        if unknown:
+            raise TypeError(f'unexpected parameters: {sorted(unknown)}')
+        values = [np.asarray(params.get(k, getattr(self, k)), dtype=float) for k in names]
+        values = [v.ravel() for v in np.broadcast_arrays(*values)]
+        ax, ay, az, rx, ry, rz, su, sv, sw, ar, rr = values
+        # 最终相机需要对准的点位
+        o = np.stack((
+            self.ox + ax + self.od * rx,
+            self.oy + ay + self.ow * ry,
+            self.oz + az + self.oh * rz), axis=1)
+        # 最终相机到物体的距离
+        ar = ar + self.oh * rr / self.robot_params['cea']
+        uvw = np.stack((su, sv, sw), axis=1)
+        d = np.zeros((len(uvw), 3))
+        d[:, 0] = -ar
+        # 俯视运动
+        poses = np.empty((len(uvw), 6))
+        if len(uvw):
+            poses[:, :3] = euler_rotation(uvw, d, degrees=True) + o
+        poses[:, 3:] = uvw
+        return poses
+
+    def gen_pose(self):
+        return Pose(*self.gen_world_n())
+
+    def gen_trajectory(self, **params):
+        return Trajectory(self.gen_world_n_batch(**params))
+
+
+# 终端回复的解析，直接在 GBK 原始字节上查找，不解码整段回复
+Where = namedtuple('Where', 'joints pose')
+Status = namedtuple('Status', (
+    'running',          # 程序运行中
+    'monitor_speed',    # 监控速度(%)
+    'program_speed',    # ALWAYS程序速度(%)，两个值
+    'accuracy',         # ALWAYS 精度[mm]
+    'completed',        # 已运行完成次数
+    'remaining',        # 剩余运行次数
+    'program',          # 程序名
+    'priority',         # 优先级
+    'step',             # 步骤号
+    'statement',        # 当前步骤的语句
+))
+
+_RUNNING = '程序运行中'.encode('GBK')
+_MONITOR_SPEED = '监控速度(%)='.encode('GBK')
+_PROGRAM_SPEED = '程序速度(%)='.encode('GBK')
+_ACCURACY = '精度[mm] ='.encode('GBK')
+_COMPLETED = '已运行完成次数:'.encode('GBK')
+_REMAINING = '剩余运行次数:'.encode('GBK')
+_STEP = '步骤号'.encode('GBK')
+_IO_GROUP = re.compile(rb'(\d+)\s*-\s*(\d+)((?:\s+[ox]+)+)')
+_SWITCH = re.compile(rb'([A-Z][A-Z0-9_.]*)\s+(ON|OFF)\b')
+_ERROR = re.compile(rb'\([PE]\d{4}\)')
+# 回复以行首的 '>' 提示符结束；回显或输出中的 '>'（如 a > b、<>）不算
+PROMPT = b'\n>'
+
+
+def _field(raw, key):
+    # key 之后到行尾的内容，找不到时返回 None
+    i = raw.find(key)
+    if i == -1:
+        return None
+    i += len(key)
+    j = raw.find(b'\n', i)
+    return raw[i:] if j == -1 else raw[i:j]
+
+
+def _line_after(raw, key):
+    # key 所在行的下一行
+    i = raw.find(key)
+    if i == -1:
+        return None
+    i = raw.find(b'\n', i) + 1
+    if not i:
+        return None
+    j = raw.find(b'\n', i)
+    return raw[i:] if j == -1 else raw[i:j]
+
+
+def parse_where(raw):
+    '''
+    WHERE
+         JT1       JT2       JT3       JT4       JT5       JT6
+        -6.552    23.595   -87.421  -147.271    88.570  -167.663
+        X[mm]     Y[mm]     Z[mm]     O[deg]    A[deg]    T[deg]
+      -214.985  1355.266  -106.276  -146.040   142.521    46.437
+    >
+    '''
+    # 按行取表头的下一行，最后一行没有换行时也完整
+    joints, pose = _line_after(raw, b'JT1'), _line_after(raw, b'X[mm]')
+    if joints is None or pose is None:
+        raise ValueError(f'不是 WHERE 的回复: {raw!r}')
+    return Where(list(map(float, joints.split())), list(map(float, pose.split())))
+
+
+def is_running(raw):
+    # 只判断 STATUS 回复中的运行状态，比完整解析快
+    return _RUNNING in raw
+
+
+def is_error(raw):
+    # 回复中有 (P1000)、(E0102) 这样的错误码
+    return _ERROR.search(raw) is not None
+
+
+def parse_status(raw):
+    # 格式见 Robot.get_status
+    def number(key, cast=float):
+        v = _field(raw, key)
+        return None if v is None else cast(v)
+
+    speed = _field(raw, _PROGRAM_SPEED)
+    speed = tuple(float(x) for x in speed.split()) if speed is not None else None
+    program = priority = step = statement = None
+    line = _line_after(raw, _STEP)
+    if line is not None and line.strip() and not line.startswith(b'>'):
+        fields = line.split(None, 3)
+        program = fields[0].decode()
+        priority, step = int(fields[1]), int(fields[2])
+        if len(fields) > 3:
+            statement = fields[3].strip().decode('GBK')
+    return Status(
+        _RUNNING in raw,
+        number(_MONITOR_SPEED), speed, number(_ACCURACY),
+        number(_COMPLETED, int), number(_REMAINING, int),
+        program, priority, step, statement)
+
+
+def parse_io(raw):
+    '''
+    IO 指令的信号状态，按 AS 手册的显示格式，o 为 ON，x 为 OFF，高位在前：
+
+      32-   1 xxxxxxxx xxxxxxxx xxxxxxxx xxxxxooo
+    1032-1001 xxxxxxxx xxxxxxxx xxxxxxxx xxxxxxxo
+
+    返回一个整数，第 n 号信号对应第 n - 1 位。
+    '''
+    bitmap = 0
+    for m in _IO_GROUP.finditer(raw):
+        hi, lo = int(m.group(1)), int(m.group(2))
+        bits = m.group(3).translate(None, b' \t\r\n')
+        bits = int(bits.translate(bytes.maketrans(b'ox', b'10')), 2)
+        bitmap |= bits << (min(hi, lo) - 1)
+    return bitmap
+
+
+def io_signal(bitmap, n):
+    return bool(bitmap >> (n - 1) & 1)
+
+
+def parse_switch(raw):
+    '''
+    SWITCH 指令的开关状态，形如：
+
+     CHECK.HOLD         OFF    CP                 ON
+     CYCLE.STOP         OFF    OX.PREOUT          ON
+
+    返回 {开关名: 是否打开}。
+    '''
+    return {k.decode(): v == b'ON' for k, v in _SWITCH.findall(raw)}
+
+
+class Program:
+    # 在本地拼好整段 AS 程序，退出编辑时用一次 sendall 写出
+
+    __slots__ = ('name', 'buf', 'count', 'end_pose', 'path')
+
+    def __init__(self, name):
+        self.name = name
+        self.buf = bytearray()
+        self.count = 0
+        self.end_pose = None    # 程序最后一个运动指令的目标位姿（人的坐标系）
+        self.path = []          # 各运动指令的目标位姿，用来估计运动时间
+
+    def add(self, statement):
+        if isinstance(statement, str):
+            statement = statement.encode()
+        if not statement.endswith(b'\n'):
+            statement = statement + b'\n'
+        self.buf += statement
+        self.count += 1
+
+    def extend(self, block, count):
+        # 一次加入 count 条已拼好的语句（每条以换行结尾）
+        self.buf += block
+        self.count += count
+
+    def getvalue(self):
+        return bytes(self.buf)
+
+
+class PoseTracker:
+    '''
+    记录最近一次下发和测得的位姿，相对移动（draw、tdraw）直接在本地合成，
+    省去每次的 WHERE 往返。
+
+    ttl 为距上次测量后本地位姿的有效时间（秒），None 表示一直有效；
+    出错、HOLD、DRAW 等无法在本地推算的操作之后会自动失效，
+    下次读取 world_n 时重新从控制器同步。
+    '''
 
-    def recv(self, feedback='>'):
-        r = b''
-        print('recv: ---------------------------------')
+    __slots__ = ('ttl', 'commanded', 'measured', 'synced_at')
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.commanded = None   # 最近一次下发的目标位姿
+        self.measured = None    # 最近一次测得的位姿
+        self.synced_at = None
+
+    @property
+    def pose(self):
+        # 仍然有效时返回本地位姿的副本，否则返回 None
+        if self.commanded is None:
+            return None
+        if self.ttl is not None:
+            if self.synced_at is None or time.monotonic() - self.synced_at > self.ttl:
+                return None
+        return list(self.commanded)
+
+    def sync(self, pose):
+        self.measured = self.commanded = list(pose)
+        self.synced_at = time.monotonic()
+
+    def command(self, pose):
+        self.commanded = list(pose)
+
+    def invalidate(self):
+        self.commanded = None
+
+
+class MotionWaiter:
+    '''
+    运动完成检测：一台机械臂共用一个轮询线程，不管有多少等待者，
+    每次只发一条 STATUS，结果通过 Future 或回调交给所有等待者。
+
+    轮询间隔根据预计的结束时间调整：离结束还远时睡剩余时间的一半（最多 max_interval），
+    接近或超过预计时间后从 min_interval 开始按 1.5 倍退避，最多到 max_backoff，
+    估计偏短时也能很快发现停下。不知道预计时间时固定每 min_interval 轮询一次。
+    '''
+
+    BACKOFF = 1.5
+
+    def __init__(self, robot, min_interval=0.05, max_interval=1.0, max_backoff=0.1):
+        self.robot = robot
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+        self.expected_end = None    # time.monotonic() 时间，None 为不知道
+        self.polls = 0              # 发出的 STATUS 次数
+        self._waiters = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def expect(self, duration):
+        # 刚开始一段预计持续 duration 秒的运动
+        self.expected_end = None if duration is None else time.monotonic() + duration
+
+    def next_interval(self, backoff, now=None):
+        # 返回 (这次睡多久, 下次的退避间隔)
+        now = time.monotonic() if now is None else now
+        end = self.expected_end
+        if end is None:
+            return self.min_interval, self.min_interval
+        if end - now > 2 * self.min_interval:
+            return min(self.max_interval, (end - now) / 2), self.min_interval
+        return backoff, min(self.max_backoff, backoff * self.BACKOFF)
+
+    def future(self, callback=None):
+        # 返回一个 concurrent.futures.Future，运动停下时结果为 True
+        fut = concurrent.futures.Future()
+        if callback is not None:
+            fut.add_done_callback(callback)
+        with self._lock:
+            self._waiters.append(fut)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return fut
+
+    def _run(self):
+        # 刚 EXECUTE 时 STATUS 可能还没变成运行中，先等一下
+        interval, backoff = self.next_interval(self.min_interval)
         while True:
-            c = self.sock.recv(256)
+            time.sleep(interval)
+            with self._lock:
+                waiters = list(self._waiters)
             try:
-                print(c.decode('GBK'))
-            except:
-                print(c)
-            r = r + c
-            if ord(feedback) in c:
-                break
-            time.sleep(self.timeout)
-        print('end recv: =============================')
+                moving = self.robot.is_moving
+            except Exception as e:
+                moving = e
+            self.polls += 1
+            if moving is not True:
+                with self._lock:
+                    for fut in waiters:
+                        self._waiters.remove(fut)
+                for fut in waiters:
+                    if fut.done():
+                        continue
+                    if isinstance(moving, Exception):
+                        fut.set_exception(moving)
+                    else:
+                        fut.set_result(True)
+            with self._lock:
+                if not self._waiters:
+                    self._thread = None
+                    return
+            interval, backoff = self.next_interval(backoff)
+
+
+class Robot:
+
+    def __init__(self, timeout=0.5, recv_timeout=10, tracker=None, params=rs10, tracer=None):
+        self.timeout = timeout
+        self.recv_timeout = recv_timeout    # 等待提示符的最长时间，None 为一直等
+        self.tracker = tracker              # PoseTracker，None 则每次都读 WHERE
+        self.params = params
+        self.speed = None                   # 最近一次 set_speed 的值（%）
+        self.tracer = tracer                # tracing.Tracer，记录收发的原始字节，None 则不记录
+        self.simplified = None              # 最近一次 simplify_path 的结果
+        self._program = None
+        self._lock = threading.RLock()      # 轮询线程和调用者共用一个终端
+        self.waiter = MotionWaiter(self)
+
+    def _write(self, data):
+        if self.tracer is not None:
+            self.tracer.record('send', data)
+        self.sock.sendall(data)
+
+    def _send(self, statement):
+        # 编辑程序时只收集语句，退出编辑时一次写出
+        if self._program is not None:
+            self._program.add(statement)
+        else:
+            self._write(statement)
+
+    def recv(self, feedback=PROMPT, timeout=-1, count=1):
+        # 有数据就读，读到 count 个提示符立即返回，不再固定休眠
+        if timeout == -1:
+            timeout = self.recv_timeout
+        if isinstance(feedback, str):
+            feedback = feedback.encode()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        r = bytearray()
+        chunk = memoryview(self._chunk)
+        start = 0
+        try:
+            while count > 0:
+                if deadline is None:
+                    ready = self._selector.select()
+                else:
+                    remaining = deadline - time.monotonic()
+                    ready = remaining > 0 and self._selector.select(remaining)
+                if not ready:
+                    raise TimeoutError(f'等待 {feedback!r} 超时: {bytes(r)!r}')
+                n = self.sock.recv_into(chunk)
+                if not n:
+                    raise ConnectionError(f'连接已断开: {bytes(r)!r}')
+                r += chunk[:n]
+                # 只在新到的数据中查找，跨块的提示符也能找到
+                count -= r.count(feedback, start)
+                start = max(0, len(r) - len(feedback) + 1)
+        finally:
+            r = bytes(r)
+            if self.tracer is not None:
+                self.tracer.record('recv', r)
         return r
 
-    def execute(self, cmd, debug=True, feedback='>'):
+    def execute(self, cmd, debug=True, feedback=PROMPT):
         if isinstance(cmd, str):
             cmd = cmd.encode()
         if not cmd.endswith(b'\n'):
@@ -108,13 +1042,41 @@ class Robot:
         # >>> print(1)
         # 1
         # >>>
-        self.sock.send(cmd)
-        r = self.recv()
+        try:
+            with self._lock:
+                self._write(cmd)
+                r = self.recv(feedback=feedback)
+        except Exception as e:
+            self._lose_pose()
+            if self.tracer is not None:
+                self.tracer.error(e)
+            raise
         return r
 
-    def connect(self, host='192.168.0.2', timeout=0.5):
+    def _track(self, pose):
+        if self.tracker is not None and pose is not None:
+            if isinstance(pose, Pose):
+                pose = list(pose.human())
+            self.tracker.command(pose)
+
+    def _lose_pose(self):
+        if self.tracker is not None:
+            self.tracker.invalidate()
+
+    def _track_reply(self, r, pose):
+        # 控制器报错时运动没有按预期开始，本地位姿不再可信
+        if is_error(r):
+            self._lose_pose()
+        else:
+            self._track(pose)
+
+    def connect(self, host='192.168.0.2', timeout=0.5, port=23):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((host, 23))
+        self.sock.connect((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._chunk = bytearray(4096)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.sock, selectors.EVENT_READ)
         return self.execute(b'as\n')
 
     # 5.6 系统控制指令
@@ -151,13 +1113,26 @@ class Robot:
         '''
         if mode:
             cmd =f'WHERE {mode}\n'
-            r = self.execute(cmd, feedback='\n')
-            self.sock.send(b'\n')
+            with self._lock:
+                r = self.execute(cmd, feedback='\n')
+                self._write(b'\n')
         else:
             cmd = b'WHERE\n'
             r = self.execute(cmd)
         return r.decode('GBK')
 
+    def read_status(self):
+        return parse_status(self.execute(b'STATUS\n'))
+
+    def read_where(self):
+        return parse_where(self.execute(b'WHERE\n'))
+
+    def read_io(self):
+        return parse_io(self.execute(b'IO\n'))
+
+    def read_switch(self):
+        return parse_switch(self.execute(b'SWITCH\n\n'))
+
     def get_io(self):
         cmd = b'IO\n'
         return self.execute(cmd).decode('GBK')
@@ -177,43 +1152,71 @@ class Robot:
         # r = self.execute(b'DO TASK(1)\n')
         cmd = b'STATUS'
         # cmd = b'DO TASK("linemove_multipose")'
-        r = self.execute(cmd)
-        print(r.decode('GBK'))
-        return r
+        return self.execute(cmd)
 
     @property
     def is_moving(self):
-        return '程序运行中' in self.get_status()
-
-    def wait(self):
-        time.sleep(0.5)
-        while self.is_moving:
-            time.sleep(0.1)
+        return is_running(self.execute(b'STATUS\n'))
+
+    def motion_done(self, callback=None):
+        # 返回一个 Future，运动停下时完成；callback(future) 在轮询线程中调用
+        return self.waiter.future(callback)
+
+    def wait(self, timeout=None):
+        return self.motion_done().result(timeout)
+
+    def motion_time(self, path, start=None):
+        # 按路径长度、姿态转过的角度和速度粗略估计运动时间（秒），不考虑加减速；
+        # 没有路径或不知道起点时返回 None
+        if not len(path) or start is None:
+            return None
+        poses = np.concatenate([np.reshape(start, (1, 6))] + [np.reshape(p, (-1, 6)) for p in path])
+        length = np.linalg.norm(np.diff(poses[:, :3], axis=0), axis=1)
+        rotations = R.from_euler('xyz', poses[:, 3:], degrees=True)
+        angle = np.degrees((rotations[:-1].inv() * rotations[1:]).magnitude())
+        scale = (self.speed or 100) / 100
+        # 位置和姿态同时插补，每段取两者中慢的
+        return np.maximum(length / self.params['v_max'], angle / self.params['w_max']).sum() / scale
+
+    def _start_pose(self):
+        return None if self.tracker is None else self.tracker.pose
 
     def get_joint_and_pose(self):
-        r = self.execute(b'wh\n')
-        r = r.split(b'\r\n')
-        joint = r[2].split()
-        joint = [float(x) for x in joint]
-        pose = r[4].split()
-        pose = [float(x) for x in pose]
-        return joint, pose
+        return parse_where(self.execute(b'wh\n'))
 
     @property
     def world_n(self):
+        if self.tracker is not None:
+            pose = self.tracker.pose
+            if pose is not None:
+                return pose
         pose = self.get_joint_and_pose()[1]
-        return pose_kawasaki_to_human(pose)
+        pose = pose_kawasaki_to_human(pose)
+        if self.tracker is not None:
+            self.tracker.sync(pose)
+        return pose
+
+    def resync(self):
+        # 丢弃本地位姿，重新从控制器读取
+        self._lose_pose()
+        return self.world_n
 
     @property
     def axis_n(self):
         return self.get_joint_and_pose()[0]
 
     def pose_move(self, pose, cmd):
-        # LMOVE or JMOVE
-        pose = pose_human_to_kawasaki(pose)
-        params = ', '.join(str(round(x, 3)) for x in pose)
+        # LMOVE or JMOVE，pose 可以是任一坐标系的 Pose
+        pose = Pose.of(pose)
+        human = list(pose.human())
+        pose = pose.kawasaki()
+        params = format_numbers(pose)
         cmd = f'DO {cmd} TRANS({params})\n'
-        return self.execute(cmd)
+        start = self._start_pose()
+        r = self.execute(cmd)
+        self.waiter.expect(self.motion_time([human], start))
+        self._track_reply(r, human)
+        return r
 
     def linemove(self, pose):
         return self.pose_move(pose, cmd='LMOVE')
@@ -223,24 +1226,33 @@ class Robot:
         return self.pose_move(pose, cmd='JMOVE')
 
     def _print(self, s):
-        self.sock.send(f'PRINT "{s}"\n'.encode())
+        self._send(f'PRINT "{s}"\n'.encode())
 
     def _edit_project(self, project_name):
         self._cur_project_name = project_name
-        cmd = f'EDIT {project_name}, 1\n'.encode()
-        self.sock.send(cmd)  # 编辑程序
-        self.sock.send(b'D 100\n')          # 删除之前的代码
-        self.sock.send(b'ACCURACY 100 ALWAYS\n')
-        self.sock.send(b'progress = 0\n')
+        self._program = Program(project_name)
+        self._send(f'EDIT {project_name}, 1\n'.encode())  # 编辑程序
+        self._send(b'D 100\n')             # 删除之前的代码
+        self._send(b'ACCURACY 100 ALWAYS\n')
+        self._send(b'progress = 0\n')
+
+    def _end_edit(self):
+        # 返回整段待上传的程序，包括最后的退出编辑
+        self._break()
+        self._send(b'progress = -2\n')
+        self._send(b'E\n')
+        program, self._program = self._program, None
+        return program.getvalue()
 
     def _execute_project(self, waiting=False):
-        self._break()
-        self.sock.send(b'progress = -2\n')
-        self.execute(b'E\n')              # 退出编辑
+        end_pose = self._program.end_pose
+        duration = self.motion_time(self._program.path, self._start_pose())
+        self.execute(self._end_edit())    # 一次写出整段程序并退出编辑
         r = self.execute(f'EXECUTE {self._cur_project_name}\n')
+        self.waiter.expect(duration)
+        self._track_reply(r, end_pose)
         if waiting:
-            while '程序结束'.encode('GBK') not in self.recv(feedback='\n'):
-                pass
+            self.wait()
         return r
 
     def set_progress(self, value):
@@ -248,9 +1260,7 @@ class Robot:
 
     def get_progress(self):
         r = self.execute('PRINT progress')
-        r = r.split(b'\n')[-2]
-        print(r)
-        return int(r)
+        return int(r.split(b'\n')[-2])
 
     def _end_edit_and_execute_project(self):
         return self._execute_project()
@@ -259,14 +1269,16 @@ class Robot:
         x, y, z = -y, x, z
         self.execute(f'POINT p = TRANS({x}, {y}, {z})\n\n')
         self.execute(b'DO TOOL p\n')
+        self._lose_pose()
 
     def _tool(self, x=0, y=0, z=0):
         x, y, z = -y, x, z
-        self.sock.send(f'TOOL TRANS({x}, {y}, {z})\n'.encode())
+        self._lose_pose()
+        self._send(f'TOOL TRANS({x}, {y}, {z})\n'.encode())
 
     def _break(self):
         # 等待上一个动作停下来
-        self.sock.send(b'BREAK\n')
+        self._send(b'BREAK\n')
 
     def _cmove(self, p0, p1, p2, _break=True):
         self._move('JMOVE', p0)
@@ -277,36 +1289,70 @@ class Robot:
 
     def _move(self, cmd, pose):
         # LMOVE or JMOVE
-        pose = pose_human_to_kawasaki(pose)
-        params = ', '.join(str(round(x, 3)) for x in pose)
+        pose = Pose.of(pose)
+        if self._program is not None:
+            human = list(pose.human())
+            self._program.end_pose = human
+            self._program.path.append(human)
+        else:
+            # 不在编辑中时直接写给控制器，不等回复，也就不知道运动到了哪里
+            self._lose_pose()
+        self._move_kawasaki(cmd, pose.kawasaki())
+
+    def _move_kawasaki(self, cmd, pose):
+        params = format_numbers(pose)
         statement = f'{cmd} TRANS({params})\n'
         statement = statement.encode()
-        self.sock.send(statement)
+        self._send(statement)
 
     def _multipose_move(self, poses, cmd):
-        for pose in poses:
-            self._move(cmd, pose)
+        # 整条轨迹一次转换、一次拼成语句，直接加入程序
+        poses = Trajectory.of(poses)
+        if not len(poses):
+            return
+        human = poses.human().array
+        self._program.end_pose = human[-1].tolist()
+        self._program.path.append(human)
+        self._program.extend(poses.statements(cmd), len(poses))
+
+    def _arc_multipose_move(self, poses, cmd, tolerance=(1.0, 1.0)):
+        # 在圆弧上的连续位姿用 C1MOVE/C2MOVE，其余用 cmd
+        poses = Trajectory.of(poses)
+        if not len(poses):
+            return
+        human = poses.human().array
+        moves = fit_arcs(human, *tolerance)
+        self._program.end_pose = human[-1].tolist()
+        self._program.path.append(human)
+        cmds = [cmd if move == 'MOVE' else move for move, i in moves]
+        index = [i for move, i in moves]
+        block = format_moves(cmds, poses.kawasaki().array[index])
+        # 与 _cmove 一样，圆弧从停稳的点开始（ACCURACY 100 ALWAYS 下前一段会连续过渡）；
+        # 第一条总是 MOVE，每条 C1MOVE 前面都有换行
+        arcs = cmds.count('C1MOVE')
+        self._program.extend(block.replace(b'\nC1MOVE', b'\nBREAK\nC1MOVE'), len(moves) + arcs)
 
     def _uwrist(self):
         # 改变形态，使JT5的角度为正值
-        self.sock.send(b'UWRIST\n')
+        self._send(b'UWRIST\n')
 
     def _set_speed(self, s, unit=''):
         cmd = f'SPEED {s}{unit}\n'.encode()
-        self.sock.send(cmd)
+        self._send(cmd)
 
     def draw_ex(self, x=0, y=0, z=0, u=0, v=0, w=0):
         # 相对世界坐标系移动
         self._edit_project('draw_ex')
 
         statement = b'REP_ONCE OFF\n'
-        self.sock.send(statement)
+        self._send(statement)
 
         params = -y, x, z, -v, u, w
-        params = ', '.join(str(round(x, 3)) for x in params)
+        params = format_numbers(params)
         statement = f'DRAW {params}\n'
+        self._lose_pose()
         statement = statement.encode()
-        self.sock.send(statement)
+        self._send(statement)
 
         return self._execute_project()
 
@@ -315,59 +1361,61 @@ class Robot:
         self._edit_project('draw_ex')
 
         statement = b'REP_ONCE OFF\n'
-        self.sock.send(statement)
+        self._send(statement)
 
         params = -y, -x, -z, -v, u, w
-        params = ', '.join(str(round(x, 3)) for x in params)
+        params = format_numbers(params)
         statement = f'TDRAW {params}\n'
+        self._lose_pose()
         statement = statement.encode()
-        self.sock.send(statement)
+        self._send(statement)
 
         return self._execute_project()
 
     def ereset(self):
+        self._lose_pose()
         self.execute(b'ereset\n')
 
-    def multipose_move(self, poses, cmd):
+    def check_reach(self, poses, tool=(0, 0, 0)):
+        # 近似的可达性检查，不占用终端；连杆长度未经核对，结果只作参考
+        return check_reach(poses, self.params, tool)
+
+    def multipose_move(self, poses, cmd, tolerance=None):
+        # tolerance 为 (mm, 度) 时先用 simplify_path 去掉多余的位姿，结果留在 self.simplified
+        # poses 可以是 Trajectory
+        if tolerance is not None:
+            poses = human_poses(poses)
+            self.simplified = simplify_path(poses, *tolerance)
+            poses = self.simplified.poses
         self._edit_project('multipose_move')
         self._multipose_move(poses, cmd)
         return self._execute_project()
 
-    def linemove_multipose(self, poses):
-        return self.multipose_move(poses, cmd='LMOVE')
+    def linemove_multipose(self, poses, tolerance=None):
+        return self.multipose_move(poses, cmd='LMOVE', tolerance=tolerance)
+
+    def freemove_multipose(self, poses, tolerance=None):
+        return self.multipose_move(poses, cmd='JMOVE', tolerance=tolerance)
 
-    def freemove_multipose(self, poses):
-        return self.multipose_move(poses, cmd='JMOVE')
+    def arcmove_multipose(self, poses, tolerance=(1.0, 1.0), cmd='LMOVE'):
+        # 环绕拍摄的轨迹：能拟合成圆弧的部分用圆弧运动，见 fit_arcs
+        self._edit_project('multipose_move')
+        self._arc_multipose_move(poses, cmd, tolerance)
+        return self._execute_project()
 
     def draw(self, x=0, y=0, z=0, u=0, v=0, w=0):
         # 相对世界坐标系移动
-        pose = self.world_n
-        pose[0] += x
-        pose[1] += y
-        pose[2] += z
-
-        m1 = R.from_euler('xyz', (u, v, w), degrees=True)
-        m2 = R.from_euler('xyz', pose[3:], degrees=True)
-        pose[3:] = (m1 * m2).as_euler('xyz', degrees=True)
-
+        pose = draw_pose(self.world_n, x, y, z, u, v, w)
         self.freemove(pose)
 
     def tdraw(self, x=0, y=0, z=0, u=0, v=0, w=0):
         # 相对相机坐标系移动
-        pose = self.world_n
-        x, y, z = R.from_euler('xyz', pose[3:], degrees=True).apply([x, y, z])
-        pose[0] += x
-        pose[1] += y
-        pose[2] += z
-
-        m1 = R.from_euler('xyz', (u, v, w), degrees=True)
-        m2 = R.from_euler('xyz', pose[3:], degrees=True)
-        pose[3:] = (m2 * m1).as_euler('xyz', degrees=True)
-
+        pose = tdraw_pose(self.world_n, x, y, z, u, v, w)
         self.freemove(pose)
 
     def drive(self, joint_id, degrees):
         cmd = f'DO DRIVE {joint_id}, {degrees}\n'
+        self._lose_pose()
         return self.execute(cmd)
 
     def cmove(self, p0, p1, p2):
@@ -377,12 +1425,76 @@ class Robot:
 
     def set_speed(self, s):
         cmd = f'SPEED {s}\n'
-        return self.execute(cmd)
+        r = self.execute(cmd)
+        self.speed = s
+        return r
 
     def stop(self):
+        self._lose_pose()
         return self.execute(b'HOLD\n')
 
+    # 遥操作：上传一次循环运行的程序，之后只改写目标点位
+    # 编辑模式下控制器会回显每一行，程序里不能出现 >，否则会被当成提示符
+    TELEOP_PROGRAM = (
+        'seen = -1',
+        'WHILE TRUE DO',
+        'IF tp_seq == seen THEN',
+        'TWAIT 0.01',
+        'ELSE',
+        'seen = tp_seq',
+        'progress = seen',      # 开始运动到第 seen 个目标
+        'JMOVE tp_target',
+        'END',
+        'END',
+    )
+
+    def _teleop_target(self, pose):
+        self._teleop_seq += 1
+        pose = Pose.of(pose).kawasaki()
+        params = format_numbers(pose)
+        # POINT 需要多一个回车确认，共两个提示符
+        return f'POINT tp_target = TRANS({params})\n\ntp_seq = {self._teleop_seq}\n'
+
+    def start_teleop(self, pose=None):
+        '''
+        上传并运行遥操作程序 teleop，程序一直循环，发现 tp_seq 变化时
+        JMOVE 到 tp_target；之后每个新目标只需调用 teleop_move。
+        pose 为初始目标，默认为当前位姿。
+        '''
+        if pose is None:
+            pose = self.world_n
+        self._teleop_seq = 0
+        self._edit_project('teleop')
+        for statement in self.TELEOP_PROGRAM:
+            self._send(statement)
+        self.execute(self._end_edit())
+        with self._lock:
+            self._write(self._teleop_target(pose).encode())
+            self.recv(count=2)
+        r = self.execute(b'EXECUTE teleop\n')
+        self._track(pose)
+        return r
+
+    def teleop_move(self, pose):
+        # 改写遥操作目标，返回本次目标的序号
+        try:
+            with self._lock:
+                self._write(self._teleop_target(pose).encode())
+                r = self.recv(count=2)
+        except Exception as e:
+            self._lose_pose()
+            if self.tracer is not None:
+                self.tracer.error(e)
+            raise
+        self._track_reply(r, pose)
+        return self._teleop_seq
+
+    def stop_teleop(self):
+        self._lose_pose()
+        return self.execute(b'ABORT\n')
+
     def disconnect(self):
+        self._selector.close()
         self.sock.close()
 
 
@@ -464,57 +1576,10 @@ def tests_3():
 
     c.ar, c.rr = 700, 0
 
-    c.su, c.sv, c.sw = 0, 1, -91    # 起点
-    pose = c.gen_world_n()
-    poses.append(pose)
-
-    c.su, c.sv, c.sw = 0, 10, -95  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 20, -100  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 30, -105  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 40, -110  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 50, -120  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 60, -140  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 70, -160  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-
-    c.su, c.sv, c.sw = 0, 80, -180  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-
-    c.su, c.sv, c.sw = 0, 70, -200  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 60, -220  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 50, -240  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 40, -250  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 30, -255  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 10, -260  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
-    c.su, c.sv, c.sw = 0, 10, -265  # 背面俯拍
-    pose = c.gen_world_n()
-    poses.append(pose)
+    # 起点，背面俯拍
+    sv = [1, 10, 20, 30, 40, 50, 60, 70, 80, 70, 60, 50, 40, 30, 10, 10]
+    sw = [-91, -95, -100, -105, -110, -120, -140, -160, -180, -200, -220, -240, -250, -255, -260, -265]
+    poses.extend(c.gen_world_n_batch(su=0, sv=sv, sw=sw).tolist())
 
     c.su, c.sv, c.sw = 0, 0, -270  # 终点
     pose = c.gen_world_n()
@@ -626,11 +1691,8 @@ def tests_8():
     robot = Robot()
     robot.connect()
 
-    pose = robot.world_n
-    pose[3] = 0
-    pose[4] = 30
-    pose[5] = 0
-    robot.freemove(pose)
+    pose = Pose.of(robot.world_n)
+    robot.freemove(pose.replace(u=0, v=30, w=0))
     robot.disconnect()
 
 
@@ -800,14 +1862,7 @@ def tests_19():
 
     c.ax = 200
     c.ar, c.rr = 800, 0                         # 相机到物品的距离
-    c.su, c.sv, c.sw = 0, 10, -40   # 起点
-    p0 = c.gen_world_n()
-
-    c.su, c.sv, c.sw = 0, 10, 0     # 中间点
-    p1 = c.gen_world_n()
-
-    c.su, c.sv, c.sw = 0, 10, 40    # 终点
-    p2 = c.gen_world_n()
+    p0, p1, p2 = c.gen_world_n_batch(sv=10, sw=np.linspace(-40, 40, 3))  # 起点、中间点、终点
 
     # robot.sock.send(b'#pose = 0.00, 0.00, 0.00, 0.00, 0.00, 0.00\n')
 
@@ -909,9 +1964,9 @@ def tests_23():
     robot._cmove(p0, p1, p2)
     robot._execute_project()
 
-    while robot.is_moving:
-        print('moving...')
-    print('finished')
+    robot.motion_done(lambda f: print('finished'))
+    robot.wait()
+    print('polls:', robot.waiter.polls)
 
     robot.disconnect()
 
@@ -948,12 +2003,9 @@ def tests_25():
     robot._cmove(p0, p1, p2)
     robot._execute_project()
 
-    while True:
-        p = robot.get_progress()
-        print('pppppppppp:', p)
-        if p == -2:
-            break
-
+    robot.wait()
+    # 程序最后一句把 progress 设为 -2
+    print('progress:', robot.get_progress())
     print('finished')
     robot.disconnect()
 
@@ -0,0 +1,75 @@
+import sys
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+# 遥操作各阶段，按先后顺序
+STAGES = (
+    'sample',       # 手机采样（手机时钟）
+    'receive',      # 服务器收到
+    'decision',     # Gate 决定下发
+    'upload',       # 写出目标
+    'ack',          # 控制器确认
+    'motion',       # 程序开始运动到该目标（progress）
+)
+
+
+class LatencyRecorder:
+    '''
+    按样本序号记录各阶段的时间，统计相邻阶段之间的延迟（滚动窗口），
+    用 dump 输出 p50/p95/p99，单位 ms。
+
+    手机和服务器的时钟不同步，receive 一项减去了窗口内见过的最小时差，
+    反映的是网络延迟相对最快一次多出的部分。
+    '''
+
+    def __init__(self, window=1000, max_open=1000):
+        self.window = window
+        self.max_open = max_open
+        self.open = OrderedDict()       # seq -> {stage: t}
+        self.spans = {stage: deque(maxlen=window) for stage in STAGES[1:]}
+        self.spans['total'] = deque(maxlen=window)
+        self.offset = None              # 服务器时钟 - 手机时钟 的最小值
+
+    def mark(self, seq, stage, t=None):
+        t = time.monotonic() if t is None else t
+        stamps = self.open.get(seq)
+        if stamps is None:
+            stamps = self.open[seq] = {}
+            if len(self.open) > self.max_open:
+                self.open.popitem(last=False)
+        stamps[stage] = t
+        i = STAGES.index(stage)
+        if stage == 'receive' and 'sample' in stamps:
+            delta = t - stamps['sample']
+            if self.offset is None or delta < self.offset:
+                self.offset = delta
+            stamps['network'] = delta - self.offset
+            self.spans[stage].append(stamps['network'])
+            return
+        for prev in reversed(STAGES[1:i]):
+            if prev in stamps:
+                self.spans[stage].append(t - stamps[prev])
+                break
+        if stage == STAGES[-1]:
+            if 'receive' in stamps:
+                total = t - stamps['receive'] + stamps.get('network', 0)
+                self.spans['total'].append(total)
+            self.open.pop(seq, None)
+
+    def percentiles(self, q=(50, 95, 99)):
+        # {阶段: (样本数, p50, p95, p99)}，单位 ms
+        result = {}
+        for stage, values in self.spans.items():
+            if values:
+                p = np.percentile(np.fromiter(values, float), q) * 1000
+                result[stage] = (len(values), *p.tolist())
+        return result
+
+    def dump(self, file=None):
+        file = sys.stdout if file is None else file
+        print(f'{"stage":<10} {"n":>6} {"p50":>9} {"p95":>9} {"p99":>9}', file=file)
+        for stage, (n, *p) in self.percentiles().items():
+            print(f'{stage:<10} {n:>6} ' + ' '.join(f'{x:9.1f}' for x in p), file=file)
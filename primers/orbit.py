@@ -0,0 +1,131 @@
+import functools
+
+import numpy as np
+
+from kawasaki_robot import Coord
+
+
+# 环绕拍摄的轨迹：方位角为 sw，俯仰角为 sv，都以度为单位
+# 物体的位置、尺寸和拍摄距离（ar、rr）沿用传入的 Coord
+
+_STATE = tuple(k for k in Coord.__slots__ if k != 'robot_params')
+
+
+def azimuth(c, start, stop, n, elevation=None):
+    # 水平环绕，俯仰角不变（默认为 c.sv）
+    sv = c.sv if elevation is None else elevation
+    return c.gen_world_n_batch(sv=sv, sw=np.linspace(start, stop, n))
+
+
+def elevation(c, start, stop, n, azimuth=None):
+    # 竖直方向扫过，方位角不变（默认为 c.sw）
+    sw = c.sw if azimuth is None else azimuth
+    return c.gen_world_n_batch(sv=np.linspace(start, stop, n), sw=sw)
+
+
+def spiral(c, start, stop, n, elevations=(10, 80)):
+    # 方位角从 start 转到 stop（可以超过 360 度），俯仰角同时均匀变化
+    return c.gen_world_n_batch(sv=np.linspace(*elevations, n), sw=np.linspace(start, stop, n))
+
+
+def dome(c, elevations=(10, 40, 70), counts=12, start=-180, stop=180, serpentine=True):
+    '''
+    多圈环绕，每个俯仰角一圈，counts 为每圈的视点数（或按圈给出）。
+    整圈时不重复终点；serpentine 时相邻两圈反向，省掉回到起点的行程。
+    '''
+    if np.ndim(counts) == 0:
+        counts = [counts] * len(elevations)
+    full = abs(stop - start) >= 360
+    sv, sw = [], []
+    for i, (e, k) in enumerate(zip(elevations, counts)):
+        ring = np.linspace(start, stop, k, endpoint=not full)
+        if serpentine and i % 2:
+            ring = ring[::-1]
+        sv.append(np.full(k, e, dtype=float))
+        sw.append(ring)
+    return c.gen_world_n_batch(sv=np.concatenate(sv), sw=np.concatenate(sw))
+
+
+SHOTS = {
+    'azimuth': azimuth,
+    'elevation': elevation,
+    'spiral': spiral,
+    'dome': dome,
+}
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class OrbitPlanner:
+    '''
+    生成并缓存常用的拍摄轨迹，同一物体、同一距离、同一参数再次请求时直接返回：
+
+        planner = OrbitPlanner()
+        c = Coord()
+        c.place_object(800, 10, -100, 1, 50, 210)
+        c.ar, c.rr = 700, 0
+        poses = planner.azimuth(c, -90, 90, 19, elevation=10)
+
+    缓存按 Coord 的全部属性和轨迹参数区分，最多保留 maxsize 条（LRU）。
+    返回的数组是只读的，需要修改时先 copy()。
+    '''
+
+    def __init__(self, maxsize=128):
+        self._cached = functools.lru_cache(maxsize=maxsize)(self._generate)
+
+    @staticmethod
+    def _generate(shot, state, cea, args, kwargs):
+        c = Coord({'cea': cea})
+        for k, v in zip(_STATE, state):
+            setattr(c, k, v)
+        poses = SHOTS[shot](c, *args, **dict(kwargs))
+        poses.setflags(write=False)
+        return poses
+
+    def shot(self, name, c, *args, **kwargs):
+        state = tuple(getattr(c, k) for k in _STATE)
+        kwargs = tuple(sorted((k, _hashable(v)) for k, v in kwargs.items()))
+        return self._cached(name, state, c.robot_params['cea'], _hashable(args), kwargs)
+
+    def azimuth(self, c, start, stop, n, elevation=None):
+        return self.shot('azimuth', c, start, stop, n, elevation=elevation)
+
+    def elevation(self, c, start, stop, n, azimuth=None):
+        return self.shot('elevation', c, start, stop, n, azimuth=azimuth)
+
+    def spiral(self, c, start, stop, n, elevations=(10, 80)):
+        return self.shot('spiral', c, start, stop, n, elevations=elevations)
+
+    def dome(self, c, elevations=(10, 40, 70), counts=12, start=-180, stop=180, serpentine=True):
+        return self.shot('dome', c, elevations=elevations, counts=counts,
+                         start=start, stop=stop, serpentine=serpentine)
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+    def cache_clear(self):
+        self._cached.cache_clear()
+
+
+planner = OrbitPlanner()
+
+
+def tests():
+    c = Coord()
+    c.place_object(800, 10, -100, 1, 50, 210)   # 物品的摆放位置及其尺寸
+    c.ar, c.rr = 700, 0                         # 相机到物品的距离
+
+    print(planner.azimuth(c, -90, 90, 19, elevation=10))
+    print(planner.dome(c, elevations=(10, 45), counts=(12, 6)).shape)
+    planner.azimuth(c, -90, 90, 19, elevation=10)
+    print(planner.cache_info())
+
+
+if __name__ == '__main__':
+    tests()
@@ -0,0 +1,60 @@
+import struct
+from collections import namedtuple
+
+
+# 手机发给服务器的姿态帧：2 字节长度 + 定长结构体
+# seq(uint32) timestamp(float64) attitude(3 * float64) immediately(bool)
+HEADER = struct.Struct('<H')
+SAMPLE = struct.Struct('<Id3d?')
+
+Sample = namedtuple('Sample', 'seq timestamp attitude immediately')
+
+
+def pack(seq, timestamp, attitude, immediately):
+    roll, pitch, yaw = attitude
+    return HEADER.pack(SAMPLE.size) + SAMPLE.pack(
+        seq & 0xffffffff, timestamp, roll, pitch, yaw, bool(immediately))
+
+
+class FrameDecoder:
+    '''
+    增量解码：每次 feed 收到的字节，返回其中所有完整的帧，
+    不完整的部分留到下次；latest 只返回最新的一帧（最新样本优先）。
+    长度比 SAMPLE 长的帧只取前面的部分，便于以后扩展字段。
+    '''
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.dropped = 0    # 长度不对被丢弃的帧
+
+    def feed(self, data):
+        buf = self.buf
+        buf += data
+        samples = []
+        i, n = 0, len(buf)
+        while n - i >= HEADER.size:
+            size, = HEADER.unpack_from(buf, i)
+            end = i + HEADER.size + size
+            if end > n:
+                break
+            if size >= SAMPLE.size:
+                seq, t, roll, pitch, yaw, immediately = SAMPLE.unpack_from(buf, i + HEADER.size)
+                samples.append(Sample(seq, t, (roll, pitch, yaw), immediately))
+            else:
+                self.dropped += 1
+            i = end
+        del buf[:i]
+        return samples
+
+    def latest(self, data):
+        return newest(self.feed(data))
+
+
+def newest(samples):
+    # 一批帧中最新的一帧，中间的帧只保留 immediately 标志，不丢掉按钮触发的那一帧
+    if not samples:
+        return None
+    sample = samples[-1]
+    if not sample.immediately and any(s.immediately for s in samples):
+        sample = sample._replace(immediately=True)
+    return sample
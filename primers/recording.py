@@ -0,0 +1,331 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import asyncio
+from collections import namedtuple, Counter
+
+from scipy.spatial.transform import Rotation as R
+
+import phone_protocol
+
+
+# 录制文件：文件头之后是首尾相接的记录，只追加不修改
+#   记录头 kind(uint8) t(float64, time.monotonic) length(uint32)，之后是 length 字节的内容
+# 每个 Recorder 打开文件时先写一条 session 记录。time.monotonic 和手机编号只在
+# 一次会话内有意义，同一个文件追加多次时按会话分开处理
+MAGIC = b'KAWREC1\n'
+RECORD = struct.Struct('<BdI')
+CLIENT = struct.Struct('<H')
+TARGET = struct.Struct('<I4d')       # 样本序号，机械臂姿态的四元数
+WALL = struct.Struct('<d')           # time.time()
+
+SEND, RECV, PHONE, DECISION, JOIN, LEAVE, ERROR, SESSION = range(1, 9)
+KINDS = {
+    'send': SEND,           # 写给控制器的字节
+    'recv': RECV,           # 控制器的回复
+    'phone': PHONE,         # 手机编号 + phone_protocol.SAMPLE，同一次读到的帧时间相同
+    'decision': DECISION,   # 滤波器决定下发的目标
+    'join': JOIN,           # 手机连接，内容为手机编号
+    'leave': LEAVE,         # 手机断开
+    'error': ERROR,         # 异常的 repr
+    'session': SESSION,     # 会话开始，内容为当时的 time.time()
+}
+NAMES = {v: k for k, v in KINDS.items()}
+
+Event = namedtuple('Event', 'kind t data')
+
+
+class Recorder:
+    '''
+    把一次会话追加写入录制文件。可以当作 Robot 的 tracer 使用，
+    记录完整的终端收发；tracer 不为 None 时同时转给它（如 Tracer）。
+
+        recorder = Recorder('session.rec', tracer=Tracer())
+        robot = AsyncRobot(tracer=recorder)
+        server = Server(robot, recorder=recorder)
+    '''
+
+    def __init__(self, path, tracer=None, buffering=65536):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab', buffering=buffering)
+        if new:
+            self.file.write(MAGIC)
+        self._write(SESSION, WALL.pack(time.time()))
+        self.tracer = tracer
+        self.clients = {}       # peername -> 手机编号
+
+    def _write(self, kind, payload, t=None):
+        t = time.monotonic() if t is None else t
+        self.file.write(RECORD.pack(kind, t, len(payload)))
+        self.file.write(payload)
+
+    def record(self, kind, data):
+        # 与 Tracer.record 相同的接口，只写入终端收发，其余只转给 tracer
+        if kind in ('send', 'recv'):
+            self._write(KINDS[kind], data)
+        if self.tracer is not None:
+            self.tracer.record(kind, data)
+
+    def error(self, e):
+        self._write(ERROR, repr(e).encode())
+        self.file.flush()
+        if self.tracer is not None:
+            self.tracer.error(e)
+
+    def client(self, peername):
+        cid = self.clients.get(peername)
+        if cid is None:
+            cid = self.clients[peername] = len(self.clients)
+        return cid
+
+    def join(self, peername, t=None):
+        self._write(JOIN, CLIENT.pack(self.client(peername)), t)
+
+    def leave(self, peername, t=None):
+        self._write(LEAVE, CLIENT.pack(self.client(peername)), t)
+
+    def phone(self, peername, sample, t=None):
+        seq, timestamp, (roll, pitch, yaw), immediately = sample
+        payload = CLIENT.pack(self.client(peername)) + phone_protocol.SAMPLE.pack(
+            seq, timestamp, roll, pitch, yaw, immediately)
+        self._write(PHONE, payload, t)
+
+    def decision(self, seq, rotation, t=None):
+        self._write(DECISION, TARGET.pack(seq & 0xffffffff, *rotation.as_quat()), t)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Recording:
+    '''
+    用 mmap 读取录制文件，只在需要时解析记录内容；
+    文件末尾不完整的记录（写入时中断）会被忽略。
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'不是录制文件: {path}')
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, kinds=None):
+        # 逐条给出 (kind, t, 内容的起止位置)，不复制内容
+        data = self.map
+        i, n = len(MAGIC), len(data)
+        while n - i >= RECORD.size:
+            kind, t, length = RECORD.unpack_from(data, i)
+            start = i + RECORD.size
+            end = start + length
+            if end > n:
+                break
+            if kinds is None or kind in kinds:
+                yield kind, t, start, end
+            i = end
+
+    def events(self, kinds=None):
+        # 手机编号换成 (会话序号, 编号)，同一会话的同一部手机总是同一个对象；
+        # 没有 session 记录的旧文件整个算作会话 0
+        wanted = None if kinds is None else {KINDS.get(k, k) for k in kinds}
+        session, clients = 0, {}
+        for kind, t, start, end in self.scan(None if wanted is None else wanted | {SESSION}):
+            if kind == SESSION:
+                session, clients = session + 1, {}
+            if wanted is not None and kind not in wanted:
+                continue
+            data = self.decode(kind, start, end)
+            if kind == PHONE:
+                cid, sample = data
+                data = clients.setdefault(cid, (session, cid)), sample
+            elif kind in (JOIN, LEAVE):
+                data = clients.setdefault(data, (session, data))
+            yield Event(NAMES.get(kind, kind), t, data)
+
+    def decode(self, kind, start, end):
+        data = self.map
+        if kind == PHONE:
+            cid, = CLIENT.unpack_from(data, start)
+            seq, t, roll, pitch, yaw, immediately = phone_protocol.SAMPLE.unpack_from(
+                data, start + CLIENT.size)
+            return cid, phone_protocol.Sample(seq, t, (roll, pitch, yaw), immediately)
+        if kind == DECISION:
+            seq, *quat = TARGET.unpack_from(data, start)
+            return seq, R.from_quat(quat)
+        if kind in (JOIN, LEAVE):
+            return CLIENT.unpack_from(data, start)[0]
+        if kind == SESSION:
+            return WALL.unpack_from(data, start)[0]
+        return bytes(data[start:end])
+
+    def summary(self):
+        # duration 是各次会话时长之和，不同会话的 time.monotonic 不能相减
+        counts = Counter()
+        spans = []
+        size = 0
+        for kind, t, start, end in self.scan():
+            counts[NAMES.get(kind, kind)] += 1
+            size += end - start
+            if kind == SESSION or not spans:
+                spans.append([t, t])
+            spans[-1][1] = t
+        return {
+            'duration': sum(last - first for first, last in spans),
+            'sessions': len(spans),
+            'counts': dict(counts),
+            'payload_bytes': size,
+        }
+
+
+class NullRobot:
+    # 不连接控制器的替身：接收遥操作目标，位置保持不变
+
+    def __init__(self, pose=(1000, 0, -100, 0, 0, 0)):
+        self.pose = list(pose)
+        self.targets = []
+        self.seq = 0
+
+    @property
+    def world_n(self):
+        async def world_n():
+            return list(self.pose)
+        return world_n()
+
+    async def teleop_move(self, pose):
+        self.seq += 1
+        self.pose = list(pose)
+        self.targets.append(self.pose)
+        return self.seq
+
+    async def get_progress(self):
+        return self.seq
+
+
+async def replay(path, robot=None, realtime=False, attitude_options=None, latency=None):
+    '''
+    把录制的手机姿态按原来的先后（realtime 时按原来的间隔）重新交给 server 的逻辑，
+    机械臂为 robot（如连接模拟器的 AsyncRobot），默认为 NullRobot。
+    同一次读到的多帧与 server 一样只处理最新的一帧。新会话开始时
+    上一次会话的手机全部断开，时间从新会话的第一条记录重新算起。返回统计结果。
+    '''
+    from server import Server
+    robot = NullRobot() if robot is None else robot
+    server = Server(robot, latency=latency, attitude_options=attitude_options)
+    driver = asyncio.create_task(server.drive_robot())
+    decisions = recorded = samples = 0
+    start = base = time.monotonic()
+    first = None
+
+    async def wait_until(t):
+        nonlocal first
+        if first is None:
+            first = t
+        delay = base + (t - first) - time.monotonic()
+        if realtime and delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)
+
+    with Recording(path) as recording:
+        batch, batch_key = [], None
+
+        async def flush():
+            nonlocal decisions
+            if batch:
+                client, t = batch_key
+                await wait_until(t)
+                if server.on_sample(client, phone_protocol.newest(batch), now=t) is not None:
+                    decisions += 1
+                batch.clear()
+
+        for event in recording.events(('phone', 'decision', 'join', 'leave', 'session')):
+            if event.kind == 'phone':
+                client, sample = event.data
+                samples += 1
+                if (client, event.t) != batch_key:
+                    await flush()
+                    batch_key = client, event.t
+                batch.append(sample)
+                continue
+            await flush()
+            if event.kind == 'session':
+                for client in list(server.arbiter.clients):
+                    server.arbiter.leave(client)
+                server.gates.clear()
+                first, base = None, time.monotonic()
+            elif event.kind == 'decision':
+                recorded += 1
+            elif event.kind == 'join':
+                server.arbiter.join(event.data)
+            elif event.kind == 'leave' and event.data in server.arbiter.clients:
+                server.arbiter.leave(event.data)
+                server.gates.pop(event.data, None)
+        await flush()
+    # 等最后一个目标下发完：正在等控制器回复的 teleop_move 被取消会打乱 robot 的收发
+    while server.target_ready.is_set():
+        await asyncio.sleep(0.01)
+    await server.idle.wait()
+    driver.cancel()
+    # 轮询 progress 的任务也等它自己结束
+    server.watching = None
+    if server.watcher is not None:
+        await server.watcher
+    return {
+        'samples': samples,
+        'decisions': decisions,
+        'recorded_decisions': recorded,
+        'elapsed': time.monotonic() - start,
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='查看或回放录制文件')
+    parser.add_argument('recording')
+    parser.add_argument('--replay', action='store_true', help='把手机姿态重新交给 server 的逻辑')
+    parser.add_argument('--realtime', action='store_true', help='按原来的间隔回放')
+    parser.add_argument('--sim', action='store_true', help='连接本地模拟器，而不是 NullRobot')
+    parser.add_argument('--filter', help='回放时使用的姿态滤波器，默认同 server')
+    args = parser.parse_args(argv)
+
+    with Recording(args.recording) as recording:
+        print(recording.summary())
+    if not args.replay:
+        return 0
+
+    async def run():
+        from latency import LatencyRecorder
+        robot = None
+        if args.sim:
+            from as_simulator import Simulator
+            from async_kawasaki_robot import AsyncRobot
+            import server
+            robot = AsyncRobot()
+            await robot.connect(*Simulator().start())
+            await robot.start_teleop(server.home)
+        options = None if args.filter is None else {'name': args.filter}
+        latency = LatencyRecorder()
+        print(await replay(args.recording, robot, args.realtime, options, latency))
+        latency.dump()
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,14 @@
 
-import json
 import socket
+import time
 
 import console
 import dialogs
 import motion
 import ui
 
+import phone_protocol
+
 
 @ui.in_background
 def message_box(title, message):
@@ -20,6 +22,7 @@ class MyView(ui.View):
     self.vx, self.vy, self.vz = 0, 0, 0
     self.ax, self.ay, self.az = 0, 0, 0
     self.i = 0
+    self.seq = 0
 
     self.max_a = 0
     self.max_v = 0
@@ -49,15 +52,12 @@ class MyView(ui.View):
 
   def exe(self, immediately=True):
     attitude = motion.get_attitude()
-    data = {
-      'attitude': attitude,
-      'immediately': immediately,
-    }
-    data = json.dumps(data).encode('utf-8')
+    self.seq += 1
+    data = phone_protocol.pack(self.seq, time.time(), attitude, immediately)
     if not hasattr(self, 'sock'):
-      self.superview.sock.send(data)
+      self.superview.sock.sendall(data)
     else:
-      self.sock.send(data)
+      self.sock.sendall(data)
 
   def update(self):
     t = 0.01
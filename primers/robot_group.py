@@ -0,0 +1,164 @@
+import sys
+import time
+import asyncio
+from collections import deque
+
+import numpy as np
+
+from kawasaki_robot import PoseTracker
+from async_kawasaki_robot import AsyncRobot
+
+
+class RobotGroup:
+    '''
+    同时控制多台机械臂，每台一个 AsyncRobot，所有操作对各台并发进行：
+
+        group = RobotGroup({'left': '192.168.0.2', 'right': ('192.168.0.3', 23)})
+        await group.connect()
+        await group.upload('shot', {'left': poses_l, 'right': poses_r})
+        await group.execute('shot')     # 各台的 EXECUTE 连续写出，启动时间差尽量小
+        await group.wait()
+        group.dump()                    # 各台各操作的耗时，找出最慢的控制器
+
+    结果都以 {名字: 结果} 返回。
+    '''
+
+    def __init__(self, addresses, tracker=True, window=100):
+        self.addresses = {}
+        for name, address in addresses.items():
+            if isinstance(address, str):
+                address = (address, 23)
+            self.addresses[name] = address
+        self.robots = {name: AsyncRobot(tracker=PoseTracker() if tracker else None)
+                       for name in self.addresses}
+        self.window = window
+        self.timings = {name: {} for name in self.robots}   # 名字 -> {操作: 最近的耗时}
+        self.skew = 0           # 最近一次 execute 第一条和最后一条 EXECUTE 写出的时间差
+        self._programs = {}     # 名字 -> (Program, 预计运动时间)，上传后等待 execute
+
+    def _record(self, name, op, seconds):
+        spans = self.timings[name].get(op)
+        if spans is None:
+            spans = self.timings[name][op] = deque(maxlen=self.window)
+        spans.append(seconds)
+
+    async def _timed(self, name, op, aw, start=None):
+        start = time.monotonic() if start is None else start
+        try:
+            return await aw
+        finally:
+            self._record(name, op, time.monotonic() - start)
+
+    async def _each(self, op, func):
+        # 对每台调用 func(name, robot)，并发等待全部完成
+        names = list(self.robots)
+        results = await asyncio.gather(
+            *(self._timed(name, op, func(name, self.robots[name])) for name in names))
+        return dict(zip(names, results))
+
+    def connect(self):
+        return self._each('connect', lambda name, robot: robot.connect(*self.addresses[name]))
+
+    def disconnect(self):
+        return self._each('disconnect', lambda name, robot: robot.disconnect())
+
+    def upload(self, project, poses, cmd='LMOVE'):
+        '''
+        把运动程序同时上传到各台，poses 为 {名字: 位姿数组}，
+        只给一个数组时所有机械臂用同一组位姿。不执行，之后用 execute 同时启动。
+        '''
+        if not isinstance(poses, dict):
+            poses = dict.fromkeys(self.robots, poses)
+
+        async def upload(name, robot):
+            robot._edit_project(project)
+            robot._multipose_move(poses[name], cmd)
+            program = robot._program
+            duration = robot.motion_time(program.path, robot._start_pose())
+            r = await robot.execute(robot._end_edit())
+            self._programs[name] = program, duration
+            return r
+        return self._each('upload', upload)
+
+    async def execute(self, project):
+        # 先把所有 EXECUTE 写出去再等回复，启动时间差只有几次 write 的耗时
+        start = time.monotonic()
+        futures = {}
+        for name, robot in self.robots.items():
+            futures[name] = robot.execute(f'EXECUTE {project}\n')
+        self.skew = time.monotonic() - start
+        names = list(futures)
+        replies = await asyncio.gather(
+            *(self._timed(name, 'execute', futures[name], start) for name in names))
+        for name, r in zip(names, replies):
+            robot = self.robots[name]
+            program, duration = self._programs.pop(name, (None, None))
+            robot.waiter.expect(duration)
+            if program is not None:
+                robot._track_reply(r, program.end_pose)
+        return dict(zip(names, replies))
+
+    def read_status(self):
+        return self._each('status', lambda name, robot: robot.read_status())
+
+    def world_n(self):
+        return self._each('where', lambda name, robot: robot.world_n)
+
+    def set_speed(self, s):
+        return self._each('speed', lambda name, robot: robot.set_speed(s))
+
+    def wait(self):
+        return self._each('wait', lambda name, robot: robot.wait())
+
+    def stop(self):
+        return self._each('stop', lambda name, robot: robot.stop())
+
+    def stats(self):
+        # {操作: {名字: (次数, 平均, p95, 最大)}}，单位 ms
+        result = {}
+        for name, ops in self.timings.items():
+            for op, spans in ops.items():
+                values = np.fromiter(spans, float) * 1000
+                result.setdefault(op, {})[name] = (
+                    len(values), values.mean(), np.percentile(values, 95), values.max())
+        return result
+
+    def bottleneck(self, op):
+        # 该操作平均耗时最长的机械臂
+        stats = self.stats().get(op)
+        if not stats:
+            return None
+        return max(stats, key=lambda name: stats[name][1])
+
+    def dump(self, file=None):
+        file = sys.stdout if file is None else file
+        print(f'{"op":<10} {"robot":<12} {"n":>5} {"mean":>9} {"p95":>9} {"max":>9}', file=file)
+        for op, stats in self.stats().items():
+            slowest = self.bottleneck(op) if len(stats) > 1 else None
+            for name, (n, *values) in stats.items():
+                flag = '  <-- 最慢' if name == slowest else ''
+                print(f'{op:<10} {name:<12} {n:>5} ' + ' '.join(f'{x:9.1f}' for x in values) + flag,
+                      file=file)
+        print(f'execute skew: {self.skew * 1e6:.0f} us', file=file)
+
+
+async def tests():
+    from kawasaki_robot import Coord
+    group = RobotGroup({'left': '192.168.0.2', 'right': '192.168.0.3'})
+    await group.connect()
+
+    c = Coord()
+    c.place_object(600 + 730, 20, -50 - 200, 1, 50, 210)
+    c.ar, c.rr = 800, 0
+    poses = c.gen_world_n_batch(su=0, sv=10, sw=np.linspace(-40, 40, 9))
+    await group.upload('group_shot', poses)
+    await group.execute('group_shot')
+    await group.wait()
+    print(await group.world_n())
+
+    group.dump()
+    await group.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(tests())
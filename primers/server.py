@@ -1,79 +1,261 @@
-import socket
-import json
+import asyncio
+import signal
 import time
 
 from scipy.spatial.transform import Rotation as R
 
 import kawasaki_robot
+import phone_protocol
+from attitude_filter import DEFAULT, make_filter
+from async_kawasaki_robot import AsyncRobot
+from latency import LatencyRecorder
+from tracing import Tracer
+from recording import Recorder
 
 
 host, port = '172.16.44.147', 88
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.bind((host, port))
+haha = True         # False 时不连接机械臂，只看手机数据
+policy = 'first'    # 多部手机时由谁控制，见 Arbiter
+home = [1000, 0, -100, 0, 0, 0]
+measure_motion = True   # 轮询 progress 记录开始运动的时间，会多占一些终端往返
+attitude = DEFAULT      # 姿态滤波器及其参数，默认见 attitude_filter.DEFAULT
+auto_lookahead = False  # 按测得的延迟中位数（total）调整 lookahead，需要 measure_motion
+record = None           # 录制文件的路径，记录手机姿态、下发的目标和终端收发，见 recording
 
 
-def get_phone_uvw(sock):
-    sock.send(b'h')
-    # data = b''
-    while True:
-        # data = data + sock.recv(1024)
-        data = sock.recv(1024)
+class Gate:
+    '''
+    把手机姿态换算成机械臂姿态：取得控制权时按两者当时的姿态标定，
+    何时下发由姿态滤波器决定（见 attitude_filter）。
+    '''
+
+    def __init__(self, robot_uvw, phone_uvw, attitude_filter=None, now=0.0):
+        self.robot_uvw = robot_uvw
+        self.t_uvw = robot_uvw * phone_uvw.inv()
+        self.filter = make_filter(**attitude) if attitude_filter is None else attitude_filter
+        self.filter.reset()
+        self.filter.update(phone_uvw, False, now)
+
+    def update(self, p_uvw, immediately, now):
+        # 返回新的机械臂姿态，不需要下发时返回 None
+        p_uvw = self.filter.update(p_uvw, immediately, now)
+        if p_uvw is None:
+            return None
+        self.robot_uvw = self.t_uvw * p_uvw
+        return self.robot_uvw
+
+
+class Arbiter:
+    '''
+    多部手机同时连接时的控制权：
+        first   先连上的手机控制，断开后交给下一部
+        button  按下按钮（immediately）的手机接管控制
+    接管时按机械臂当前姿态重新标定，不会跳动。
+    '''
+
+    POLICIES = ('first', 'button')
+
+    def __init__(self, policy='first'):
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown policy: {policy}')
+        self.policy = policy
+        self.clients = []       # 按连接顺序
+        self.owner = None
+
+    def join(self, client):
+        self.clients.append(client)
+        if self.owner is None:
+            self.owner = client
+
+    def leave(self, client):
+        self.clients.remove(client)
+        if self.owner is client:
+            self.owner = self.clients[0] if self.clients else None
+
+    def allows(self, client, immediately):
+        if client is not self.owner and self.policy == 'button' and immediately:
+            self.owner = client
+        return client is self.owner
+
+
+class Server:
+
+    def __init__(self, robot=None, policy='first', latency=None, attitude_options=None, tracer=None,
+                 recorder=None):
+        self.robot = robot
+        self.tracer = tracer        # Tracer，记录下发的目标，None 则不记录
+        self.recorder = recorder    # recording.Recorder，None 则不录制
+        self.attitude_options = attitude if attitude_options is None else attitude_options
+        self.arbiter = Arbiter(policy)
+        self.gates = {}
+        self.robot_uvw = R.identity()
+        self.target = None
+        self.target_seq = None      # 产生该目标的手机样本序号
+        self.target_ready = asyncio.Event()
+        self.idle = asyncio.Event()  # 没有正在下发的目标
+        self.idle.set()
+        self.latency = latency      # LatencyRecorder，None 则不统计
+        self.watching = None        # (样本序号, tp_seq, 截止时间)，等待开始运动的最新目标
+        self.watcher = None         # 轮询 progress 的任务，同时只有一个
+
+    def on_sample(self, client, sample, now=None):
+        # 处理一帧手机姿态，需要下发时返回新的目标姿态
+        now = time.monotonic() if now is None else now
+        p_uvw = R.from_euler('xyz', sample.attitude)
+        owner = self.arbiter.owner
+        if not self.arbiter.allows(client, sample.immediately):
+            self.gates.pop(client, None)
+            return None
+        if self.arbiter.owner is not owner:
+            self.gates.clear()
+        gate = self.gates.get(client)
+        if gate is None:
+            # 刚取得控制权，以机械臂当前姿态为基准
+            self.gates[client] = Gate(self.robot_uvw, p_uvw, make_filter(**self.attitude_options), now)
+            return None
+        robot_uvw = gate.update(p_uvw, sample.immediately, now)
+        if robot_uvw is not None:
+            if self.latency is not None:
+                self.latency.mark(sample.seq, 'decision')
+            if self.recorder is not None:
+                self.recorder.decision(sample.seq, robot_uvw, now)
+            self.robot_uvw = robot_uvw
+            self.target = robot_uvw
+            self.target_seq = sample.seq
+            self.target_ready.set()
+        return robot_uvw
+
+    async def handle_phone(self, reader, writer):
+        client = writer.get_extra_info('peername')
+        print('accept:', client)
+        decoder = phone_protocol.FrameDecoder()
+        recorder = self.recorder
+        self.arbiter.join(client)
+        if recorder is not None:
+            recorder.join(client)
         try:
-            data = json.loads(data.decode('utf-8'))
-            break
-        except:
-            print(data)
-    uvw = data['attitude']
-    print('phone.uvw:', uvw)
-    uvw = R.from_euler('xyz', uvw)
-    return uvw, data['immediately']
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                samples = decoder.feed(data)
+                if recorder is not None:
+                    now = time.monotonic()
+                    for sample in samples:
+                        recorder.phone(client, sample, now)
+                # 一次读到多帧时只处理最新的一帧
+                sample = phone_protocol.newest(samples)
+                if sample is not None:
+                    if self.latency is not None:
+                        self.latency.mark(sample.seq, 'sample', sample.timestamp)
+                        self.latency.mark(sample.seq, 'receive')
+                    self.on_sample(client, sample)
+        finally:
+            self.arbiter.leave(client)
+            self.gates.pop(client, None)
+            if recorder is not None:
+                recorder.leave(client)
+            writer.close()
+            print('close:', client)
+
+    async def drive_robot(self):
+        # 单独的任务下发目标，控制器回复慢也不影响接收手机数据
+        while True:
+            await self.target_ready.wait()
+            self.target_ready.clear()
+            self.idle.clear()
+            try:
+                await self.send_target()
+            finally:
+                self.idle.set()
 
+    async def send_target(self):
+        # 下发最新的目标，等到控制器回复
+        uvw = self.target.as_euler('xyz', degrees=True)
+        seq = self.target_seq
+        if self.tracer is not None:
+            self.tracer.record('target', (seq, uvw))
+        if self.robot is None:
+            return
+        u, v, w = uvw
+        pose = kawasaki_robot.Pose.of(await self.robot.world_n).replace(u=u, v=-v, w=w)
+        latency = self.latency
+        if latency is not None:
+            latency.mark(seq, 'upload')
+        tp_seq = await self.robot.teleop_move(pose)
+        if latency is not None:
+            latency.mark(seq, 'ack')
+            if measure_motion:
+                self.watch(seq, tp_seq)
+            if auto_lookahead:
+                self.update_lookahead()
 
-haha = True
-robot = kawasaki_robot.Robot()
-if haha:
-    robot.connect()
+    def update_lookahead(self):
+        # 外推到目标预计到达的时候，超出范围时由 Predictor 限制
+        total = self.latency.percentiles((50,)).get('total')
+        if total is None:
+            return
+        for gate in self.gates.values():
+            predictor = getattr(gate.filter, 'predictor', None)
+            if predictor is not None:
+                predictor.lookahead = total[1] / 1000
 
-status = 0    # 0 初始， 1 转动， 2 稳定
+    def watch(self, seq, tp_seq, timeout=5):
+        # 只等最新的目标，被取代的目标不再等；已有轮询任务时只更新它等的目标
+        self.watching = seq, tp_seq, time.monotonic() + timeout
+        if self.watcher is None or self.watcher.done():
+            self.watcher = asyncio.create_task(self.watch_motion())
 
-while True:
-    print('listen(1)')
-    sock.listen(1)
-    client_sock, client_address = sock.accept()
-    print('accept:', client_address)
+    async def watch_motion(self):
+        # 遥操作程序开始运动到第 tp_seq 个目标时会把 progress 设为 tp_seq
+        while self.watching is not None:
+            seq, tp_seq, deadline = watching = self.watching
+            if time.monotonic() >= deadline:
+                self.watching = None
+                return
+            if await self.robot.get_progress() >= tp_seq:
+                self.latency.mark(seq, 'motion')
+                if self.watching is watching:
+                    self.watching = None
+                continue
+            await asyncio.sleep(0.02)
 
+
+async def main():
+    tracer = Tracer()   # 最近的终端收发和下发的目标，出错时自动输出
+    recorder = None if record is None else Recorder(record, tracer=tracer)
+    try:
+        with tracer.guard():
+            await serve(tracer, recorder)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+async def serve(tracer, recorder=None):
+    robot = None
     if haha:
-        pose = [1000, 0, -100, 0, 0, 0]
+        # 只改变朝向，位置沿用上次下发的目标，不必每次读 WHERE
+        robot = AsyncRobot(tracker=kawasaki_robot.PoseTracker(), tracer=recorder or tracer)
+        await robot.connect()
         robot._edit_project('haha')
-        robot._move('JMOVE', pose)
-        robot._execute_project(True)
-    robot_uvw = R.from_euler('xyz', [0, 0, 0], degrees=True)
-    phone_uvw, _ = get_phone_uvw(client_sock)
-    t_uvw = robot_uvw * phone_uvw.inv()
-
-    while True:
-        # client's request
-        p_uvw, immediately = get_phone_uvw(client_sock)
-        t = (t_uvw * p_uvw) * robot_uvw.inv()
-        if not immediately and R.magnitude(t) > 20 / 180 * 3.14:
-            status = 1
-            robot_uvw = t_uvw * p_uvw
-        elif not immediately and 0 < status and status < 10:
-            status += 1
-        elif immediately or status == 10:
-            robot_uvw = t_uvw * p_uvw
-            print(robot_uvw.as_euler('xyz', degrees=True), p_uvw.as_euler('xyz', degrees=True))
-            status = 0
-            if haha and robot.get_progress() < 0:
-                pose = robot.world_n
-                pose[3:] = robot_uvw.as_euler('xyz', degrees=True)
-                pose[4] = -pose[4]
-
-                robot.set_progress(0)
-                robot._edit_project('haha')
-                robot._move('JMOVE', pose)
-                robot._execute_project()
-
-        time.sleep(0.1)
-
-    client_sock.close()
+        robot._move('JMOVE', home)
+        await robot._execute_project(True)
+        await robot.start_teleop(home)
+    latency = LatencyRecorder()
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid> 输出延迟统计，kill -USR2 <pid> 输出最近的跟踪记录
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, latency.dump)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, tracer.dump)
+    server = Server(robot, policy, latency, tracer=tracer, recorder=recorder)
+    phones = await asyncio.start_server(server.handle_phone, host, port)
+    print('listen:', host, port)
+    try:
+        async with phones:
+            await asyncio.gather(phones.serve_forever(), server.drive_robot())
+    finally:
+        latency.dump()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+import sys
+import time
+import contextlib
+from collections import deque
+
+
+class Tracer:
+    '''
+    固定大小的环形缓冲，记录收发的原始字节和其他事件：
+
+        tracer = Tracer()
+        robot = Robot(tracer=tracer)
+        ...
+        tracer.dump()       # 需要时再解码输出
+
+    record 只把 (时间, 类型, 数据) 放进 deque，不解码、不格式化；
+    不需要跟踪时传 None，调用处只多一次 is not None 的判断。
+    出错时调用 error 或用 guard 包住，会自动输出最近的记录。
+    '''
+
+    def __init__(self, size=4096, encoding='GBK', file=None, echo=False):
+        self.events = deque(maxlen=size)
+        self.encoding = encoding
+        self.file = file        # dump 的默认输出，None 为 sys.stderr
+        self.echo = echo        # 调试时边记录边输出
+        self.start = time.monotonic()
+
+    def record(self, kind, data):
+        event = (time.monotonic(), kind, data)
+        self.events.append(event)
+        if self.echo:
+            print(self.format(event), file=sys.stdout)
+
+    def format(self, event):
+        t, kind, data = event
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode(self.encoding, 'replace')
+            data = data.replace('\r', '\\r').replace('\n', '\\n\n' + ' ' * 20).rstrip()
+        return f'{t - self.start:12.6f} {kind:<6} {data}'
+
+    def dump(self, file=None, last=None):
+        file = file or self.file or sys.stderr
+        events = list(self.events)
+        if last is not None:
+            events = events[-last:]
+        print(f'---- trace: {len(events)} events ----', file=file)
+        for event in events:
+            print(self.format(event), file=file)
+        print('---- end trace ----', file=file)
+
+    def error(self, e):
+        self.record('error', repr(e))
+        self.dump()
+
+    @contextlib.contextmanager
+    def guard(self):
+        # 包住的代码抛出异常时先输出记录再继续抛出
+        try:
+            yield self
+        except Exception as e:
+            self.error(e)
+            raise
+
+    def clear(self):
+        self.events.clear()